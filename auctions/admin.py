@@ -8,4 +8,6 @@ admin.site.register(Comment)
 admin.site.register(Listing)
 admin.site.register(Category)
 admin.site.register(User)
-admin.site.register(Notification)
\ No newline at end of file
+admin.site.register(Notification)
+admin.site.register(PhotoBlob)
+admin.site.register(Job)
@@ -0,0 +1,169 @@
+from django.db.models import F
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from .models import Bid, Category, Comment, Listing
+from .pagination import paginate
+from .storage import photo_storage
+
+
+# Read-only JSON API, version 1. Each resource maps its public field names to
+# ORM lookups; ?fields=a,b picks a subset, read with .values().
+
+API_PAGE_SIZE = 50
+
+LISTING_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "description": "description",
+    "starting_price": "starting_price",
+    "current_price": "current_price",
+    "bid_count": "bid_count",
+    "active": "active",
+    "created": "datetime",
+    "ends_at": "ends_at",
+    "category": "category__name",
+    "owner": "owner__username",
+    "photo": "photo",
+}
+LISTING_DEFAULT = ("id", "title", "current_price", "bid_count", "active", "created", "ends_at", "category")
+
+BID_FIELDS = {
+    "id": "id",
+    "value": "value",
+    "user": "user__username",
+    "created": "datetime",
+}
+BID_DEFAULT = tuple(BID_FIELDS)
+
+COMMENT_FIELDS = {
+    "id": "id",
+    "text": "text",
+    "user": "user__username",
+    "created": "datetime",
+}
+COMMENT_DEFAULT = tuple(COMMENT_FIELDS)
+
+CATEGORY_FIELDS = {
+    "id": "id",
+    "name": "name",
+    "active_listings": "active_listings",
+}
+
+
+class FieldError(ValueError):
+    pass
+
+
+def selected_fields(request, available, default):
+    requested = request.GET.get("fields")
+    if not requested:
+        return default
+    fields = tuple(dict.fromkeys(name.strip() for name in requested.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in available]
+    if unknown or not fields:
+        raise FieldError(f"Unknown fields: {', '.join(unknown) or requested!r}. "
+                         f"Available: {', '.join(available)}.")
+    return fields
+
+
+def rows(queryset, available, fields, extra=()):
+    # Prefixed so they can't clash with the `extra` lookups.
+    return queryset.values(*extra, **{f"api_{name}": F(available[name]) for name in fields})
+
+
+def serialize(row, fields):
+    data = {name: row[f"api_{name}"] for name in fields}
+    if "photo" in data:
+        data["photo"] = photo_storage().url(data["photo"]) if data["photo"] else None
+    return data
+
+
+def error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+def page_data(request, queryset, available, default, field):
+    fields = selected_fields(request, available, default)
+    page = paginate(request, rows(queryset, available, fields, extra=(field, "pk")),
+                    field=field, per_page=API_PAGE_SIZE)
+    return page, {
+        "data": [serialize(row, fields) for row in page],
+        "next": page.next_url,
+        "previous": page.previous_url,
+    }
+
+
+@require_GET
+def listings(request):
+    queryset = Listing.objects.all()
+    status = request.GET.get("status", "active")
+    if status in ("active", "closed"):
+        queryset = queryset.filter(active=status == "active")
+    elif status != "all":
+        return error("status must be one of active, closed, all.", 400)
+    if request.GET.get("category"):
+        queryset = queryset.filter(category__name=request.GET["category"])
+    if request.GET.get("owner"):
+        queryset = queryset.filter(owner__username=request.GET["owner"])
+    try:
+        page, data = page_data(request, queryset, LISTING_FIELDS, LISTING_DEFAULT, "datetime")
+    except FieldError as exception:
+        return error(str(exception), 400)
+    return JsonResponse(data)
+
+
+@require_GET
+def listing(request, id):
+    try:
+        fields = selected_fields(request, LISTING_FIELDS, tuple(LISTING_FIELDS))
+    except FieldError as exception:
+        return error(str(exception), 400)
+    row = rows(Listing.objects.filter(pk=id), LISTING_FIELDS, fields).first()
+    if row is None:
+        return error("Listing not found.", 404)
+    data = serialize(row, fields)
+    data["links"] = {
+        "html": reverse("listing", args=[id]),
+        "bids": reverse("api_listing_bids", args=[id]),
+        "comments": reverse("api_listing_comments", args=[id]),
+    }
+    return JsonResponse({"data": data})
+
+
+def listing_page(request, id, queryset, available, default, field, found=False):
+    try:
+        page, data = page_data(request, queryset.filter(listing=id), available, default, field)
+    except FieldError as exception:
+        return error(str(exception), 400)
+    if not page and not found and not Listing.objects.filter(pk=id).exists():
+        return error("Listing not found.", 404)
+    return JsonResponse(data)
+
+
+@require_GET
+def listing_bids(request, id):
+    owner = Listing.objects.filter(pk=id).values_list("owner", flat=True).first()
+    if owner is None:
+        return error("Listing not found.", 404)
+    # As on the listing page, only the owner sees who bid.
+    if request.user.id != owner:
+        return error("Only the owner of a listing can see its bids.", 403)
+    # Accepted bids only go up, so their value orders them by time.
+    return listing_page(request, id, Bid.objects.all(), BID_FIELDS, BID_DEFAULT, "value", found=True)
+
+
+@require_GET
+def listing_comments(request, id):
+    return listing_page(request, id, Comment.objects.all(), COMMENT_FIELDS, COMMENT_DEFAULT, "datetime")
+
+
+@require_GET
+def categories(request):
+    try:
+        fields = selected_fields(request, CATEGORY_FIELDS, tuple(CATEGORY_FIELDS))
+    except FieldError as exception:
+        return error(str(exception), 400)
+    queryset = rows(Category.objects.order_by("name"), CATEGORY_FIELDS, fields)
+    return JsonResponse({"data": [serialize(row, fields) for row in queryset]})
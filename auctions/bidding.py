@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from django.utils import timezone
+
+from .models import Bid, Listing, StaleBid
+
+
+ACCEPTED = "accepted"
+TOO_LOW = "too_low"
+STALE = "stale"
+CLOSED = "closed"
+FORBIDDEN = "forbidden"
+
+MESSAGES = {
+    ACCEPTED: "Your bid was placed.",
+    TOO_LOW: "Your bid must be higher than the current one.",
+    STALE: "Someone has just outbid you, please try a higher bid.",
+    CLOSED: "This listing is closed.",
+    FORBIDDEN: "You cannot bid on your own listing.",
+}
+
+
+@dataclass
+class BidOutcome:
+    status: str
+    current_price: int
+    bid: Optional[Bid] = None
+
+    @property
+    def accepted(self):
+        return self.status == ACCEPTED
+
+    @property
+    def message(self):
+        return MESSAGES[self.status]
+
+
+def place_bid(listing, user, value):
+    """Place a bid of `value` by `user`, returning a BidOutcome.
+
+    The checks against `listing` only give early, friendly answers; the
+    authoritative check is the compare-and-set in Listing.record_bid(), done
+    in the same transaction as the insert.
+    """
+    if not listing.is_open:
+        return BidOutcome(CLOSED, listing.current_price)
+    if user.pk == listing.owner_id:
+        return BidOutcome(FORBIDDEN, listing.current_price)
+    if value < listing.starting_price or (listing.bid_count and value <= listing.current_price):
+        return BidOutcome(TOO_LOW, listing.current_price)
+
+    bid = Bid(value=value, user=user, listing=listing, datetime=timezone.now())
+    try:
+        bid.save()
+    except StaleBid:
+        current = Listing.objects.only("active", "ends_at", "current_price").get(pk=listing.pk)
+        status = STALE if current.is_open else CLOSED
+        return BidOutcome(status, current.current_price)
+
+    listing.current_price = value
+    listing.bid_count += 1
+    listing.leading_bid = bid
+    listing.leading_user = user
+    return BidOutcome(ACCEPTED, value, bid)
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from django.db import transaction
+
+from . import stamps
+
+
+# The categories and their active listing counts, held in process memory.
+# Changes made elsewhere are picked up within TIMEOUT seconds.
+TIMEOUT = 30
+
+_lock = threading.Lock()
+_catalog = None
+
+
+class Catalog:
+    def __init__(self, categories):
+        self.categories = categories
+        self.by_name = {category.name: category for category in categories}
+        self.loaded = time.monotonic()
+
+    @property
+    def fresh(self):
+        return time.monotonic() - self.loaded < TIMEOUT
+
+
+def get_catalog():
+    global _catalog
+    catalog = _catalog
+    if catalog is None or not catalog.fresh:
+        from .models import Category
+
+        with _lock:
+            if _catalog is None or not _catalog.fresh:
+                _catalog = Catalog(list(Category.objects.order_by("pk")))
+            catalog = _catalog
+    return catalog
+
+
+def categories():
+    return get_catalog().categories
+
+
+def get(name):
+    """Return the category called `name`, or None."""
+    category = get_catalog().by_name.get(name)
+    if category is None:
+        from .models import Category
+
+        # Possibly created by another process since the catalog was loaded.
+        if Category.objects.filter(name=name).exists():
+            invalidate()
+            category = get_catalog().by_name.get(name)
+    return category
+
+
+def invalidate():
+    global _catalog
+    _catalog = None
+
+
+def changed(category_ids):
+    """Reload the catalog, and mark the feeds of the given categories changed."""
+    # Again after the commit, as another thread may reload it in between.
+    invalidate()
+    transaction.on_commit(invalidate)
+    stamps.touch_categories(category_ids)
@@ -0,0 +1,86 @@
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from . import events, jobs, stamps
+from .models import Category, Listing, Notification, User
+
+
+BATCH_SIZE = 500
+
+
+def close_expired_batch(now=None, batch_size=BATCH_SIZE):
+    """Close up to `batch_size` expired listings and return how many; safe to run concurrently."""
+    now = now or timezone.now()
+    locking = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic():
+        expired = Listing.objects.expired(now).order_by("ends_at", "pk")
+        if locking:
+            expired = expired.select_for_update(skip_locked=True, of=("self",))
+        rows = list(expired.values(
+            "pk", "title", "current_price", "bid_count", "leading_user_id", "category_id",
+            "owner__username",
+        )[:batch_size])
+        if not rows:
+            return 0
+
+        if locking:
+            Listing.objects.filter(pk__in=[row["pk"] for row in rows]).update(
+                active=False, version=F("version") + 1)
+        else:
+            # Without row locks, the conditional update decides who closes each row.
+            rows = [
+                row for row in rows
+                if Listing.objects.filter(pk=row["pk"], active=True).update(
+                    active=False, version=F("version") + 1)
+            ]
+        closed = Counter(row["category_id"] for row in rows)
+        Category.objects.add_active_listings({category: -count for category, count in closed.items()})
+        notify_winners(rows, now)
+        watched = (Listing.users_watching.through.objects
+                   .filter(listing__in=[row["pk"] for row in rows])
+                   .order_by().values_list("listing", flat=True).distinct())
+        jobs.enqueue_many("notify_watchers", [{"listing_id": listing} for listing in watched])
+        stamps.touch_listings([(row["pk"], row["category_id"]) for row in rows])
+
+    for row in rows:
+        events.publish(row["pk"], "closed", {
+            "current_price": row["current_price"],
+            "bid_count": row["bid_count"],
+            "active": False,
+        })
+    return len(rows)
+
+
+def notify_winners(rows, now):
+    won = [row for row in rows if row["leading_user_id"]]
+    Notification.objects.bulk_create([
+        Notification(
+            user_id=row["leading_user_id"],
+            listing_id=row["pk"],
+            kind=Notification.WON,
+            text=f"Congratulations! You won the bid {row['owner__username']}'s '{row['title']}'!",
+            datetime=now,
+            url=reverse("listing", args=[row["pk"]]),
+        )
+        for row in won
+    ], batch_size=BATCH_SIZE)
+    # bulk_create skips Notification.save(), so bump the unread counters here.
+    users_by_wins = defaultdict(list)
+    for user, wins in Counter(row["leading_user_id"] for row in won).items():
+        users_by_wins[wins].append(user)
+    for wins, users in users_by_wins.items():
+        User.objects.filter(pk__in=users).update(unread_count=F("unread_count") + wins)
+
+
+def close_expired(now=None, batch_size=BATCH_SIZE):
+    """Close every listing that has expired by `now`, one transaction per batch."""
+    total = 0
+    while True:
+        closed = close_expired_batch(now, batch_size)
+        if not closed:
+            return total
+        total += closed
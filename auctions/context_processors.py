@@ -0,0 +1,18 @@
+from django.utils.functional import SimpleLazyObject
+
+
+def unread_notifications(request):
+    # The counter comes with the user row the auth middleware already loads,
+    # so this costs no query; it is still only read once per request.
+    if not hasattr(request, "_unread_notifications"):
+        user = getattr(request, "user", None)
+        request._unread_notifications = user.unread_count if user and user.is_authenticated else 0
+    return {"unread": request._unread_notifications}
+
+
+def watched_listings(request):
+    # Loaded on first use only, from a cache keyed by the user's watchlist version.
+    user = getattr(request, "user", None)
+    if not user or not user.is_authenticated:
+        return {"watched": frozenset()}
+    return {"watched": SimpleLazyObject(user.watched_ids)}
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import re
+import select
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = re.compile(r"^/listing/(?P<id>\d+)/events$")
+HEARTBEAT = 15
+# Clients that fall this far behind are disconnected and reconnect.
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    def __init__(self, channel, loop):
+        self.channel = channel
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE + 1)
+        self.closed = False
+
+    def put(self, message):
+        if self.closed:
+            return
+        if self.queue.qsize() >= QUEUE_SIZE:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.closed, message = True, None
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    """Fans messages out to the subscribers of this process, from any thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = defaultdict(set)
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel, asyncio.get_running_loop())
+        with self.lock:
+            self.channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.channels.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.channels.pop(subscription.channel, None)
+
+    def has_subscribers(self, channel):
+        return channel in self.channels
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:  # the subscriber's loop has shut down
+                self.unsubscribe(subscription)
+
+
+broker = Broker()
+
+
+class LocalBackend:
+    """Delivers events to watchers connected to this process only."""
+
+    def start(self):
+        pass
+
+    def listening(self, channel):
+        return broker.has_subscribers(channel)
+
+    def publish(self, channel, message):
+        broker.deliver(channel, message)
+
+
+class PostgresBackend:
+    """Shares events between processes with PostgreSQL LISTEN/NOTIFY."""
+
+    CHANNEL = "auction_events"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def start(self):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name="auction-events", daemon=True)
+                self.listener.start()
+
+    def listening(self, channel):
+        return True
+
+    def publish(self, channel, message):
+        payload = json.dumps({"channel": channel, "message": message}, cls=DjangoJSONEncoder)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.CHANNEL, payload])
+
+    def listen(self):
+        import psycopg2
+
+        while True:
+            try:
+                listener = psycopg2.connect(**connection.get_connection_params())
+                try:
+                    listener.autocommit = True
+                    listener.cursor().execute(f"LISTEN {self.CHANNEL}")
+                    while True:
+                        select.select([listener], [], [], HEARTBEAT)
+                        listener.poll()
+                        while listener.notifies:
+                            event = json.loads(listener.notifies.pop(0).payload)
+                            broker.deliver(event["channel"], event["message"])
+                finally:
+                    listener.close()
+            except Exception:
+                logger.exception("Event listener lost its connection, reconnecting")
+                threading.Event().wait(1)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.EVENTS_BACKEND)()
+    return _backend
+
+
+def listing_channel(listing_id):
+    return f"listing:{listing_id}"
+
+
+def publish(listing_id, event, data):
+    """Send `event` to the watchers of a listing once the current transaction commits."""
+    def send():
+        backend, channel = get_backend(), listing_channel(listing_id)
+        if not backend.listening(channel):
+            return
+        try:
+            backend.publish(channel, {"event": event, "data": data})
+        except Exception:
+            logger.exception("Could not publish %s event of listing %s", event, listing_id)
+    transaction.on_commit(send)
+
+
+def listing_snapshot(listing_id):
+    from .models import Listing
+
+    return Listing.objects.filter(pk=listing_id).values("current_price", "bid_count", "active").first()
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n".encode()
+
+
+@sync_to_async
+def load_snapshot(listing_id):
+    close_old_connections()
+    try:
+        return listing_snapshot(listing_id)
+    finally:
+        close_old_connections()
+
+
+async def listing_events(scope, receive, send, listing_id):
+    """Stream the events of one listing to an EventSource client."""
+    snapshot = await load_snapshot(listing_id)
+    if snapshot is None:
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    get_backend().start()
+    subscription = broker.subscribe(listing_channel(listing_id))
+    disconnected = asyncio.ensure_future(_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": format_event("price", snapshot), "more_body": True})
+        while not disconnected.done():
+            message = asyncio.ensure_future(subscription.get())
+            await asyncio.wait({message, disconnected}, timeout=HEARTBEAT,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not message.done():
+                message.cancel()
+                if not disconnected.done():
+                    await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+                continue
+            if message.result() is None:
+                break
+            body = format_event(message.result()["event"], message.result()["data"])
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+async def _disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def events_application(application):
+    """Wrap the Django ASGI application, serving listing event streams without a thread each."""
+    async def app(scope, receive, send):
+        match = scope["type"] == "http" and EVENTS_PATH.match(scope["path"])
+        if match and scope["method"] == "GET":
+            await listing_events(scope, receive, send, int(match["id"]))
+        else:
+            await application(scope, receive, send)
+    return app
@@ -0,0 +1,62 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from . import stamps
+
+
+# Bounding boxes of the resized copies kept next to each listing photo. The
+# card sizes match the 300x200 box listing cards are drawn in.
+VARIANTS = {
+    "card": (300, 200),
+    "card-2x": (600, 400),
+    "detail": (1280, 1280),
+}
+FORMAT = "WEBP"
+EXTENSION = ".webp"
+QUALITY = 80
+
+
+def variant_name(name, variant):
+    root, _ = os.path.splitext(name)
+    return f"{root}.{variant}{EXTENSION}"
+
+
+def render_variant(image, size):
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    output = BytesIO()
+    image.save(output, FORMAT, quality=QUALITY, method=4)
+    return output.getvalue()
+
+
+def generate_variants(name, storage=default_storage):
+    """Write every variant of the stored image `name`, replacing old copies."""
+    with storage.open(name) as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    for variant, size in VARIANTS.items():
+        target = variant_name(name, variant)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(render_variant(image, size)))
+    return name
+
+
+def process_listing_photo(listing):
+    from .models import Listing
+
+    if not listing.photo:
+        return
+    generate_variants(listing.photo.name)
+    with transaction.atomic():
+        if Listing.objects.filter(pk=listing.pk, photo=listing.photo.name).update(
+                photo_variants_for=listing.photo.name, version=F("version") + 1):
+            stamps.touch_listing(listing.pk, listing.category_id)
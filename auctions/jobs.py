@@ -0,0 +1,87 @@
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+VISIBILITY_TIMEOUT = timedelta(minutes=5)
+
+
+def task(name):
+    """Register the decorated function as the handler of jobs named `name`."""
+    def register(function):
+        TASKS[name] = function
+        return function
+    return register
+
+
+def enqueue(name, max_attempts=5, **payload):
+    # Inserted in the caller's transaction: workers only see the job once the
+    # data it refers to is committed, and never if it is rolled back.
+    if name not in TASKS:
+        raise KeyError(f"Unknown task {name!r}")
+    return Job.objects.create(task=name, payload=payload, max_attempts=max_attempts)
+
+
+def enqueue_many(name, payloads, max_attempts=5):
+    if name not in TASKS:
+        raise KeyError(f"Unknown task {name!r}")
+    return Job.objects.bulk_create(
+        [Job(task=name, payload=payload, max_attempts=max_attempts) for payload in payloads],
+        batch_size=500,
+    )
+
+
+def claim(worker, limit, timeout=VISIBILITY_TIMEOUT):
+    """Claim up to `limit` due jobs for `worker` and return them."""
+    now = timezone.now()
+    token = f"{worker[:55]}:{uuid.uuid4().hex[:8]}"
+    with transaction.atomic():
+        # The worker running their last attempt died before finishing them.
+        Job.objects.filter(status=Job.QUEUED, run_at__lte=now, attempts__gte=F("max_attempts")).update(
+            status=Job.FAILED, claimed_by="", last_error="Not finished within the visibility timeout.")
+        due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by("run_at", "pk")
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list("pk", flat=True)[:limit])
+        if not ids:
+            return []
+        # Without row locks (SQLite) another worker may have selected the same
+        # rows; the conditional update makes sure each job goes to one of us.
+        Job.objects.filter(pk__in=ids, status=Job.QUEUED, run_at__lte=now).update(
+            run_at=now + timeout, claimed_by=token, attempts=F("attempts") + 1)
+    return list(Job.objects.filter(pk__in=ids, claimed_by=token).order_by("pk"))
+
+
+def execute(job):
+    try:
+        TASKS[job.task](**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Job %s failed (attempt %s of %s)", job, job.attempts, job.max_attempts)
+        claimed = Job.objects.filter(pk=job.pk, claimed_by=job.claimed_by)
+        if job.attempts >= job.max_attempts:
+            claimed.update(status=Job.FAILED, last_error=error)
+        else:
+            backoff = timedelta(seconds=2 ** job.attempts)
+            claimed.update(run_at=timezone.now() + backoff, claimed_by="", last_error=error)
+        return False
+    Job.objects.filter(pk=job.pk, claimed_by=job.claimed_by).delete()
+    return True
+
+
+def run_pending(worker="worker", limit=10, timeout=VISIBILITY_TIMEOUT):
+    """Claim and run one batch of due jobs, returning how many were claimed."""
+    jobs = claim(worker, limit, timeout)
+    for job in jobs:
+        execute(job)
+    return len(jobs)
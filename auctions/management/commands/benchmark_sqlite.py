@@ -0,0 +1,116 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+from django.utils import timezone
+
+from auctions.bidding import place_bid
+from auctions.models import Comment, Listing, User
+
+
+PROFILES = {
+    "default": "",
+    "concurrent": "concurrent",
+}
+
+
+class Command(BaseCommand):
+    help = ("Measure concurrent bid and comment throughput on SQLite, with and without "
+            "the concurrent profile (SQLITE_PROFILE=concurrent).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Worker processes writing at once, like gunicorn workers.")
+        parser.add_argument("--duration", type=float, default=10, help="Seconds each run lasts.")
+        parser.add_argument("--listings", type=int, default=20)
+        parser.add_argument("--users", type=int, default=40)
+        parser.add_argument("--comment-share", type=float, default=0.3,
+                            help="Fraction of operations that are comments rather than bids.")
+        parser.add_argument("--profile", choices=sorted(PROFILES), action="append",
+                            help="Only run these profiles (default: all).")
+        # Used by the worker processes the benchmark starts.
+        parser.add_argument("--worker", type=int, help=None)
+        parser.add_argument("--start-at", type=float, help=None)
+
+    def handle(self, *args, **options):
+        if options["worker"] is not None:
+            return self.work(options)
+        results = []
+        for profile in options["profile"] or sorted(PROFILES):
+            with tempfile.TemporaryDirectory() as directory:
+                results.append((profile, self.run(profile, os.path.join(directory, "bench.sqlite3"), options)))
+
+        self.stdout.write(f"{'profile':<12}{'ops/s':>9}{'bids':>8}{'comments':>10}{'outbid':>8}{'locked':>8}")
+        for profile, totals in results:
+            self.stdout.write(
+                f"{profile:<12}{totals['ops'] / options['duration']:>9.1f}{totals['bids']:>8}"
+                f"{totals['comments']:>10}{totals['rejected']:>8}{totals['locked']:>8}"
+            )
+
+    def run(self, profile, path, options):
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{path}", "SQLITE_PROFILE": PROFILES[profile]}
+        env.pop("DATABASE_REPLICA_URLS", None)
+
+        def manage(*arguments, **kwargs):
+            return subprocess.Popen([sys.executable, "-m", "django", *arguments], env=env,
+                                    cwd=settings.BASE_DIR, stdout=subprocess.PIPE, **kwargs)
+
+        self.stdout.write(f"Preparing the {profile} profile...")
+        for arguments in (
+            ["migrate", "--no-input"],
+            ["seed_auctions", f"--users={options['users']}", f"--listings={options['listings']}",
+             "--bids=0", "--comments=0", "--notifications=0", "--watchlist=0", "--seed=0"],
+        ):
+            if manage(*arguments, stderr=subprocess.DEVNULL).wait():
+                raise CommandError(f"Could not run {arguments[0]} for the benchmark database.")
+
+        # Workers start together, once they have all imported Django.
+        start_at = time.time() + 2
+        workers = [
+            manage("benchmark_sqlite", "--skip-checks", f"--worker={number}", f"--start-at={start_at}",
+                   f"--duration={options['duration']}", f"--comment-share={options['comment_share']}")
+            for number in range(options["workers"])
+        ]
+        totals = {"ops": 0, "bids": 0, "comments": 0, "rejected": 0, "locked": 0}
+        for worker in workers:
+            output, _ = worker.communicate()
+            if worker.returncode:
+                raise CommandError(f"A {profile} benchmark worker failed.")
+            for name, value in json.loads(output.decode().strip().splitlines()[-1]).items():
+                totals[name] += value
+        return totals
+
+    def work(self, options):
+        rng = random.Random(options["worker"])
+        users = list(User.objects.values_list("pk", flat=True))
+        listings = list(Listing.objects.filter(active=True).values_list("pk", flat=True))
+        counts = {"ops": 0, "bids": 0, "comments": 0, "rejected": 0, "locked": 0}
+        time.sleep(max(0, options["start_at"] - time.time()))
+        deadline = time.monotonic() + options["duration"]
+        while time.monotonic() < deadline:
+            listing_id = rng.choice(listings)
+            try:
+                if rng.random() < options["comment_share"]:
+                    Comment.objects.create(user_id=rng.choice(users), listing_id=listing_id,
+                                           text="Is this still available?", datetime=timezone.now())
+                    counts["comments"] += 1
+                else:
+                    listing = Listing.objects.get(pk=listing_id)
+                    user = User.objects.get(pk=rng.choice(users))
+                    if place_bid(listing, user, listing.current_price + rng.randint(1, 5)).accepted:
+                        counts["bids"] += 1
+                    else:
+                        counts["rejected"] += 1
+                counts["ops"] += 1
+            except OperationalError as error:
+                if "locked" not in str(error):
+                    raise
+                counts["locked"] += 1
+        self.stdout.write(json.dumps(counts))
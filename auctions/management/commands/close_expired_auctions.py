@@ -0,0 +1,37 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from auctions.closing import BATCH_SIZE, close_expired
+
+
+class Command(BaseCommand):
+    help = "Close listings whose end time has passed and notify their winners. Safe to run on several nodes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                            help="Listings closed per transaction.")
+        parser.add_argument("--loop", action="store_true", help="Keep running, checking every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        previous = {signum: signal.signal(signum, self.stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            while not self.stopping:
+                close_old_connections()
+                started = time.monotonic()
+                closed = close_expired(batch_size=options["batch_size"])
+                if closed or not options["loop"]:
+                    self.stdout.write(f"Closed {closed} listing(s) in {time.monotonic() - started:.2f}s.")
+                if not options["loop"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,61 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from auctions import images
+from auctions.models import Listing, PhotoBlob
+from auctions.storage import BLOB_NAME
+
+
+class Command(BaseCommand):
+    help = "Delete stored listing photos that no listing has referenced for a while."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace-hours", type=float, default=24,
+                            help="Keep unreferenced blobs at least this long.")
+
+    def handle(self, *args, **options):
+        self.storage = Listing._meta.get_field("photo").storage
+        cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        deleted = freed = 0
+        for blob in PhotoBlob.objects.filter(references=0, released__lt=cutoff).iterator():
+            # Uploaded again, for a listing that is still being saved.
+            if self.recent(blob.name, cutoff):
+                continue
+            # Re-checked in the delete itself, in case the blob was just reused.
+            if not PhotoBlob.objects.filter(pk=blob.pk, references=0).delete()[0]:
+                continue
+            self.delete(blob.name)
+            deleted += 1
+            freed += blob.size
+        # Uploads whose listing was never saved have no PhotoBlob at all.
+        for name in self.blob_files():
+            if self.recent(name, cutoff) or PhotoBlob.objects.filter(name=name).exists() \
+                    or Listing.objects.filter(photo=name).exists():
+                continue
+            freed += self.storage.size(name)
+            self.delete(name)
+            deleted += 1
+        self.stdout.write(f"Deleted {deleted} unreferenced blob(s), {freed} byte(s) freed.")
+
+    def recent(self, name, cutoff):
+        return self.storage.exists(name) and self.storage.get_modified_time(name) >= cutoff
+
+    def blob_files(self, directory=""):
+        if directory and not self.storage.exists(directory):
+            return
+        directories, files = self.storage.listdir(directory)
+        for name in directories:
+            yield from self.blob_files(os.path.join(directory, name))
+        for name in files:
+            path = os.path.join(directory, name)
+            # Variants are deleted along with their original.
+            if BLOB_NAME.match(path) and len(os.path.splitext(name)[0]) == 64:
+                yield path
+
+    def delete(self, name):
+        for name in [name] + [images.variant_name(name, variant) for variant in images.VARIANTS]:
+            if self.storage.exists(name):
+                self.storage.delete(name)
@@ -0,0 +1,96 @@
+import hashlib
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
+from django.utils import timezone
+
+from auctions import images, stamps
+from auctions.models import Listing, PhotoBlob
+from auctions.storage import BLOB_NAME, ContentAddressedStorage
+
+
+VARIANT_SUFFIXES = tuple(f".{variant}{images.EXTENSION}" for variant in images.VARIANTS)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = "Move existing listing photos into content-addressed storage, keeping one copy per unique file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only report what would be moved and how much space it frees.")
+
+    def handle(self, *args, **options):
+        storage = Listing._meta.get_field("photo").storage
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError("Listing photos are not kept in ContentAddressedStorage.")
+        directory = Listing._meta.get_field("photo").upload_to
+        root = storage.path(directory)
+        dry_run = options["dry_run"]
+
+        renamed = {}
+        for filename in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+            old = f"{directory}/{filename}"
+            path = storage.path(old)
+            if not os.path.isfile(path) or filename.startswith(".") or filename.endswith(VARIANT_SUFFIXES):
+                continue
+            renamed[old] = storage.blob_name(directory, file_digest(path), os.path.splitext(filename)[1])
+
+        freed, seen = 0, set()
+        for old, new in renamed.items():
+            moves = [(old, new)] + [
+                (images.variant_name(old, variant), images.variant_name(new, variant))
+                for variant in images.VARIANTS
+            ]
+            for source, target in moves:
+                if not storage.exists(source):
+                    continue
+                if target in seen or storage.exists(target):
+                    freed += storage.size(source)
+                    if not dry_run:
+                        storage.delete(source)
+                elif not dry_run:
+                    os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+                    os.replace(storage.path(source), storage.path(target))
+                seen.add(target)
+
+        self.stdout.write(f"{len(renamed)} photo(s) are {len(set(renamed.values()))} unique blob(s); "
+                          f"{freed} byte(s) {'can be' if dry_run else 'were'} freed.")
+        if dry_run:
+            return
+
+        with transaction.atomic():
+            for old, new in renamed.items():
+                Listing.objects.filter(photo=old).update(
+                    photo=new,
+                    photo_variants_for=Case(When(photo_variants_for=old, then=Value(new)), default=Value("")),
+                    version=F("version") + 1,
+                )
+            self.recount(storage, set(renamed.values()))
+            stamps.touch_feeds()
+
+    def recount(self, storage, moved):
+        """Rebuild every blob's reference count from the listings that use it."""
+        now = timezone.now()
+        counts = dict(Listing.objects.exclude(photo="").order_by()
+                      .values_list("photo").annotate(count=Count("pk")))
+        names = {name for name in counts if BLOB_NAME.match(name) and storage.exists(name)}
+        names.update(moved)
+        names.update(PhotoBlob.objects.values_list("name", flat=True))
+        for name in names:
+            references = counts.get(name, 0)
+            PhotoBlob.objects.update_or_create(name=name, defaults={
+                "size": storage.size(name) if storage.exists(name) else 0,
+                "references": references,
+                "released": None if references else now,
+            })
+        self.stdout.write(f"Recounted references of {len(names)} blob(s).")
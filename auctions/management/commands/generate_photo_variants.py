@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from auctions import stamps
+from auctions.images import generate_variants
+from auctions.models import Listing
+
+
+def _generate(name):
+    try:
+        generate_variants(name)
+    except Exception as error:
+        return name, f"{type(error).__name__}: {error}"
+    return name, None
+
+
+class Command(BaseCommand):
+    help = "Generate the resized photo variants of existing listings in parallel worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--force", action="store_true",
+                            help="Regenerate variants that already exist.")
+
+    def handle(self, *args, **options):
+        listings = Listing.objects.exclude(photo="")
+        if not options["force"]:
+            listings = listings.exclude(photo_variants_for=F("photo"))
+        names = sorted(set(listings.values_list("photo", flat=True)))
+        self.stdout.write(f"Processing {len(names)} photo(s) with {options['workers']} worker(s).")
+
+        # Workers only read and write storage; the database is updated here.
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=django.setup) as pool:
+            for future in as_completed([pool.submit(_generate, name) for name in names]):
+                name, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+                    continue
+                with transaction.atomic():
+                    Listing.objects.filter(photo=name).update(
+                        photo_variants_for=name, version=F("version") + 1)
+                    stamps.touch_feeds()
+                done += 1
+        self.stdout.write(f"Generated variants of {done} photo(s), {failed} failed.")
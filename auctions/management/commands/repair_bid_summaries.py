@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from auctions import stamps
+from auctions.models import Listing
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized price, bid count and leader of every listing from its bids."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Only report listings whose stored summary is out of date.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["verify"]:
+            with transaction.atomic():
+                updated = Listing.objects.refresh_bid_summary()
+                stamps.touch_feeds()
+            self.stdout.write(f"Refreshed bid summary of {updated} listing(s).")
+            return
+
+        stale = []
+        rows = Listing.objects.with_bid_summary().values_list(
+            "id", *Listing.BID_SUMMARY_FIELDS,
+            *(f"actual_{name}" for name in Listing.BID_SUMMARY_FIELDS),
+        )
+        width = len(Listing.BID_SUMMARY_FIELDS)
+        for id, *values in rows.iterator():
+            if values[:width] != values[width:]:
+                stale.append(id)
+                self.stdout.write(f"Listing {id}: stored {values[:width]}, actual {values[width:]}")
+        if stale:
+            raise CommandError(f"{len(stale)} listing(s) have a stale bid summary.")
+        self.stdout.write("All bid summaries are up to date.")
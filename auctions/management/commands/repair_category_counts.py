@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions import catalog
+from auctions.models import Category, active_listings_expression
+
+
+class Command(BaseCommand):
+    help = "Recompute every category's active listing counter from its listings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Only report categories whose stored counter is out of date.",
+        )
+
+    def handle(self, *args, **options):
+        actual = active_listings_expression()
+        if not options["verify"]:
+            updated = Category.objects.update(active_listings=actual)
+            catalog.changed(Category.objects.values_list("pk", flat=True))
+            self.stdout.write(f"Refreshed active listing counter of {updated} category(ies).")
+            return
+
+        stale = 0
+        rows = Category.objects.annotate(actual=actual).values_list("name", "active_listings", "actual")
+        for name, stored, actual in rows.iterator():
+            if stored != actual:
+                stale += 1
+                self.stdout.write(f"Category {name}: stored {stored}, actual {actual}")
+        if stale:
+            raise CommandError(f"{stale} category(ies) have a stale active listing counter.")
+        self.stdout.write("All active listing counters are up to date.")
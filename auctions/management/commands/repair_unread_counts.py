@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.models import User, unread_count_expression
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's unread notification counter from their notifications."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Only report users whose stored counter is out of date.",
+        )
+
+    def handle(self, *args, **options):
+        actual = unread_count_expression()
+        if not options["verify"]:
+            updated = User.objects.update(unread_count=actual)
+            self.stdout.write(f"Refreshed unread counter of {updated} user(s).")
+            return
+
+        stale = 0
+        rows = User.objects.annotate(actual=actual).values_list("username", "unread_count", "actual")
+        for username, stored, actual in rows.iterator():
+            if stored != actual:
+                stale += 1
+                self.stdout.write(f"User {username}: stored {stored}, actual {actual}")
+        if stale:
+            raise CommandError(f"{stale} user(s) have a stale unread counter.")
+        self.stdout.write("All unread counters are up to date.")
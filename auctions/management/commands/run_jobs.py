@@ -0,0 +1,46 @@
+import os
+import signal
+import socket
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from auctions import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs. Start as many worker processes as needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=10, help="Jobs claimed at a time.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--visibility-timeout", type=float, default=300,
+                            help="Seconds before a claimed but unfinished job is handed out again.")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due.")
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        timeout = timedelta(seconds=options["visibility_timeout"])
+        self.stopping = False
+        previous = {signum: signal.signal(signum, self.stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+
+        processed = 0
+        try:
+            while not self.stopping:
+                close_old_connections()
+                claimed = jobs.run_pending(worker, options["batch"], timeout)
+                processed += claimed
+                if not claimed:
+                    if options["once"]:
+                        break
+                    time.sleep(options["sleep"])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(f"Worker {worker} ran {processed} job(s).")
+
+    def stop(self, signum, frame):
+        # Finish the batch in hand; unstarted claimed jobs reappear after the timeout.
+        self.stopping = True
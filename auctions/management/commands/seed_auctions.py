@@ -0,0 +1,197 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.urls import reverse
+
+from auctions.models import Bid, Category, Comment, Listing, Notification, User
+
+
+CATEGORIES = ["Tech", "Home", "Fashion", "Antiques", "Cars", "Toys", "Books", "Sports"]
+# Used when there are no existing listing photos to reuse.
+PHOTOS = [
+    "listings/tech1.jpg",
+    "listings/tech2.png",
+    "listings/tech3.jpg",
+    "listings/antique1.jpg",
+    "listings/sofa.png",
+    "listings/2022-tesla-model-x.jpg",
+]
+ADJECTIVES = ["Vintage", "Brand new", "Used", "Rare", "Handmade", "Refurbished", "Classic", "Compact"]
+NOUNS = ["laptop", "sofa", "camera", "watch", "bicycle", "guitar", "lamp", "jacket", "phone", "vase"]
+WORDS = ("great condition works perfectly barely used original box shipping included "
+         "small scratch on the side comes with charger pickup only collector item").split()
+# Seeded rows are dated relative to a fixed point so a seed always yields the same data.
+END = datetime(2021, 10, 1, tzinfo=timezone.utc)
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a large, deterministic synthetic auction dataset for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--listings", type=int, default=1000)
+        parser.add_argument("--bids", type=int, default=20000)
+        parser.add_argument("--comments", type=int, default=5000)
+        parser.add_argument("--notifications", type=int, default=5000)
+        parser.add_argument("--watchlist", type=int, default=5,
+                            help="Average number of listings each user watches.")
+        parser.add_argument("--hot-listings", type=float, default=0.01,
+                            help="Fraction of listings that are hot.")
+        parser.add_argument("--hot-share", type=float, default=0.5,
+                            help="Fraction of all bids and comments that go to hot listings.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", default="seed",
+                            help="Username prefix of the generated users; must not be in use yet.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        if options["users"] < 2 or options["listings"] < 1:
+            raise CommandError("Need at least two users and one listing.")
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users prefixed '{options['prefix']}-' already exist; pick another --prefix.")
+
+        categories = self.seed_categories()
+        users = self.seed_users(options["users"], options["prefix"])
+        listings = self.seed_listings(options["listings"], users, categories)
+        hot = max(1, int(len(listings) * options["hot_listings"]))
+        self.pick_listing = lambda: self.skewed(listings, hot, options["hot_share"])
+        self.seed_bids(options["bids"], users)
+        self.seed_comments(options["comments"], users)
+        self.seed_watchlists(options["watchlist"], users, listings)
+        self.seed_notifications(options["notifications"], users)
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def skewed(self, rows, hot, hot_share):
+        if self.rng.random() < hot_share:
+            return rows[self.rng.randrange(hot)]
+        return rows[self.rng.randrange(len(rows))]
+
+    def insert(self, model, rows):
+        """Bulk insert `rows` in batches and return their new primary keys in order."""
+        last_pk = model.objects.aggregate(last=Max("pk"))["last"] or 0
+        with transaction.atomic():
+            for start in range(0, len(rows), self.batch_size):
+                model.objects.bulk_create(rows[start:start + self.batch_size])
+        pks = list(model.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True))
+        self.stdout.write(f"Created {len(pks)} {model._meta.verbose_name_plural}.")
+        return pks
+
+    def stream(self, model, rows):
+        """Bulk insert a (possibly huge) generator of rows without holding it in memory."""
+        batch, total = [], 0
+        with transaction.atomic():
+            for row in rows:
+                batch.append(row)
+                if len(batch) == self.batch_size:
+                    model.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            model.objects.bulk_create(batch)
+        self.stdout.write(f"Created {total + len(batch)} {model._meta.verbose_name_plural}.")
+
+    def seed_categories(self):
+        Category.objects.bulk_create([Category(name=name) for name in CATEGORIES], ignore_conflicts=True)
+        return list(Category.objects.order_by("pk").values_list("pk", flat=True))
+
+    def seed_users(self, count, prefix):
+        password = make_password("password")
+        return self.insert(User, [
+            User(username=f"{prefix}-{i}", email=f"{prefix}-{i}@example.com", password=password)
+            for i in range(count)
+        ])
+
+    def seed_listings(self, count, users, categories):
+        self.listing_info = {}
+        photos = sorted(set(Listing.objects.exclude(photo="").values_list("photo", flat=True))) or PHOTOS
+        rows = []
+        for i in range(count):
+            created = END - timedelta(seconds=self.rng.randrange(180 * 24 * 3600))
+            starting_price = self.rng.randint(1, 500)
+            rows.append(Listing(
+                title=f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} #{i}",
+                description=" ".join(self.rng.choices(WORDS, k=self.rng.randint(5, 40))).capitalize(),
+                starting_price=starting_price,
+                current_price=starting_price,
+                photo=self.rng.choice(photos),
+                category_id=self.rng.choice(categories),
+                owner_id=self.rng.choice(users),
+                active=self.rng.random() < 0.9,
+                datetime=created,
+            ))
+        pks = self.insert(Listing, rows)
+        # bulk_create skips the signals that count photo references.
+        storage = Listing._meta.get_field("photo").storage
+        if hasattr(storage, "acquire"):
+            for photo, uses in Counter(row.photo.name for row in rows).items():
+                storage.acquire(photo, uses)
+        call_command("repair_category_counts", stdout=self.stdout)
+        for pk, row in zip(pks, rows):
+            self.listing_info[pk] = row
+        return pks
+
+    def seed_bids(self, count, users):
+        per_listing = {}
+        for _ in range(count):
+            pk = self.pick_listing()
+            per_listing[pk] = per_listing.get(pk, 0) + 1
+
+        def bids():
+            for pk in sorted(per_listing):
+                listing = self.listing_info[pk]
+                value, when = listing.starting_price, listing.datetime
+                for _ in range(per_listing[pk]):
+                    user = self.rng.choice(users)
+                    while user == listing.owner_id:
+                        user = self.rng.choice(users)
+                    when += timedelta(seconds=self.rng.randint(1, 3600))
+                    yield Bid(listing_id=pk, user_id=user, value=value, datetime=when)
+                    value += self.rng.randint(1, max(1, value // 10))
+
+        self.stream(Bid, bids())
+        Listing.objects.filter(pk__gte=min(self.listing_info)).refresh_bid_summary()
+
+    def seed_comments(self, count, users):
+        def comments():
+            for _ in range(count):
+                pk = self.pick_listing()
+                yield Comment(
+                    listing_id=pk,
+                    user_id=self.rng.choice(users),
+                    text=" ".join(self.rng.choices(WORDS, k=self.rng.randint(3, 30))).capitalize(),
+                    datetime=self.listing_info[pk].datetime + timedelta(seconds=self.rng.randrange(7 * 24 * 3600)),
+                )
+
+        self.stream(Comment, comments())
+
+    def seed_watchlists(self, average, users, listings):
+        Watch = User.watchlist.through
+
+        def watches():
+            for user in users:
+                for pk in set(self.pick_listing() for _ in range(self.rng.randint(0, 2 * average))):
+                    yield Watch(user_id=user, listing_id=pk)
+
+        self.stream(Watch, watches())
+
+    def seed_notifications(self, count, users):
+        def notifications():
+            for _ in range(count):
+                pk = self.pick_listing()
+                yield Notification(
+                    user_id=self.rng.choice(users),
+                    text=f"There is a new bid on '{self.listing_info[pk].title}'",
+                    url=reverse("listing", args=[pk]),
+                    datetime=self.listing_info[pk].datetime + timedelta(seconds=self.rng.randrange(7 * 24 * 3600)),
+                    seen=self.rng.random() < 0.7,
+                )
+
+        self.stream(Notification, notifications())
+        call_command("repair_unread_counts", stdout=self.stdout)
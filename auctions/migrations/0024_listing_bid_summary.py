@@ -0,0 +1,52 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:19
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_bid_summary(apps, schema_editor):
+    Listing = apps.get_model('auctions', 'Listing')
+    Bid = apps.get_model('auctions', 'Bid')
+    top_bid = Bid.objects.filter(listing=OuterRef('pk')).order_by('-value', 'id')
+    bid_count = (Bid.objects.filter(listing=OuterRef('pk')).order_by()
+                 .values('listing').annotate(count=Count('pk')).values('count'))
+    Listing.objects.update(
+        current_price=Coalesce(Subquery(top_bid.values('value')[:1]), F('starting_price')),
+        bid_count=Coalesce(Subquery(bid_count), 0),
+        leading_bid=Subquery(top_bid.values('pk')[:1]),
+        leading_user=Subquery(top_bid.values('user')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0023_alter_listing_photo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='bid_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='current_price',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='leading_bid',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='auctions.bid'),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='leading_user',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leading_listings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_bid_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_unread_count(apps, schema_editor):
+    User = apps.get_model('auctions', 'User')
+    Notification = apps.get_model('auctions', 'Notification')
+    unread = (Notification.objects.filter(user=OuterRef('pk'), seen=False).order_by()
+              .values('user').annotate(count=Count('pk')).values('count'))
+    User.objects.update(unread_count=Coalesce(Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0024_listing_bid_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_unread_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0025_user_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', '-value'], name='bid_listing_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['user', '-datetime', '-id'], name='bid_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['listing', '-datetime'], name='comment_listing_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', True)), fields=['-datetime', '-id'], name='listing_active_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', True)), fields=['category', '-datetime', '-id'], name='listing_category_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['owner', '-datetime', '-id'], name='listing_owner_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('seen', False)), fields=['user'], name='notification_unseen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-datetime', '-id'], name='notification_user_recent_idx'),
+        ),
+    ]
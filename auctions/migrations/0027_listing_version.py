@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0026_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0027_listing_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='photo_variants_for',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
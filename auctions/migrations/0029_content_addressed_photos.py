@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:32
+
+import auctions.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0028_listing_photo_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('released', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='listing',
+            name='photo',
+            field=models.ImageField(default=None, storage=auctions.storage.photo_storage, upload_to='listings'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS auctions_listing_fts USING fts5(
+        title, description, content='auctions_listing', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_insert AFTER INSERT ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_delete AFTER DELETE ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(auctions_listing_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS auctions_listing_fts_update
+    AFTER UPDATE OF title, description ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(auctions_listing_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO auctions_listing_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+    "INSERT INTO auctions_listing_fts(auctions_listing_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS auctions_listing_fts_update",
+    "DROP TRIGGER IF EXISTS auctions_listing_fts_delete",
+    "DROP TRIGGER IF EXISTS auctions_listing_fts_insert",
+    "DROP TABLE IF EXISTS auctions_listing_fts",
+]
+
+POSTGRESQL_FORWARD = [
+    """ALTER TABLE auctions_listing ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX listing_search_idx ON auctions_listing USING gin (search_vector)",
+]
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX listing_search_idx",
+    "ALTER TABLE auctions_listing DROP COLUMN search_vector",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+# Full-text index over listing titles and descriptions, see auctions.search.
+# It lives outside the model state: SQLite gets an FTS5 table kept in sync by
+# triggers, PostgreSQL a generated tsvector column, other databases nothing.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0030_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRESQL_FORWARD}),
+            run({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRESQL_BACKWARD}),
+        ),
+    ]
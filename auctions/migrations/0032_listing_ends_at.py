@@ -0,0 +1,22 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0031_listing_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active', True), ('ends_at__isnull', False)), fields=['ends_at', 'id'], name='listing_ending_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0032_listing_ends_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='kind',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='listing',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='auctions.listing'),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('seen', False)), fields=('listing', 'kind', 'user'), name='notification_unread_once'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0033_notification_fan_out'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='watchlist_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
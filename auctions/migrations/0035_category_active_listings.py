@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_active_listings(apps, schema_editor):
+    Category = apps.get_model('auctions', 'Category')
+    Listing = apps.get_model('auctions', 'Listing')
+    active = (Listing.objects.filter(category=OuterRef('pk'), active=True).order_by()
+              .values('category').annotate(count=Count('pk')).values('count'))
+    Category.objects.update(active_listings=Coalesce(Subquery(active), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0034_user_watchlist_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_listings',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_active_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0035_category_active_listings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageStamp',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('modified', models.DateTimeField()),
+            ],
+        ),
+    ]
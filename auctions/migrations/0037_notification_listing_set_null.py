@@ -0,0 +1,19 @@
+# Generated by Django 3.2.7 on 2026-10-18 21:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0036_pagestamp'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='listing',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='auctions.listing'),
+        ),
+    ]
@@ -1,41 +1,307 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.cache import cache
 from django.core import validators
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import (BooleanField, Case, Count, ExpressionWrapper, F, Max, OuterRef, Q,
+                              Subquery, Value, When)
+from django.db.models.functions import Coalesce, Substr
 from django.db.models.fields.related import ForeignKey
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from collections import defaultdict
 from datetime import datetime
 
-class User(AbstractUser):
+from . import images, storage
+
+# Watched ids are keyed by watchlist version, so this only bounds how long
+# sets of inactive users linger in the cache.
+WATCHED_IDS_TIMEOUT = 24 * 3600
+
+class MaintainedFieldsMixin:
+    """Keeps saves of an existing row from writing back its MAINTAINED_FIELDS.
+
+    Those are kept up to date with queryset updates, so the instance's copy
+    may be stale.
+    """
+    MAINTAINED_FIELDS = ()
+
+    def exclude_maintained_fields(self, kwargs):
+        if not self._state.adding and self.pk and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
+        return kwargs
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **self.exclude_maintained_fields(kwargs))
+
+class User(MaintainedFieldsMixin, AbstractUser):
+    MAINTAINED_FIELDS = ("unread_count", "watchlist_version")
+
     watchlist = models.ManyToManyField('Listing', blank=True, related_name="users_watching")
+    # Number of unseen notifications, kept up to date by Notification.
+    unread_count = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped on every watchlist change; keys the cached set of watched ids.
+    watchlist_version = models.PositiveIntegerField(default=1, editable=False)
 
     def unread(self):
-        return self.notifications.filter(seen=False).count()
+        return self.unread_count
+
+    def watched_ids(self):
+        """The ids of the listings this user watches, cached until the watchlist changes."""
+        key = f"watched:{self.pk}:{self.watchlist_version}"
+        watched = cache.get(key)
+        if watched is None:
+            watched = frozenset(self.watchlist.through.objects.filter(user=self.pk)
+                                .values_list("listing", flat=True))
+            cache.set(key, watched, WATCHED_IDS_TIMEOUT)
+        return watched
+
+    def is_watching(self, listing):
+        # One probe of the (user, listing) unique index.
+        return self.watchlist.through.objects.filter(user=self.pk, listing=listing.pk).exists()
+
+    def watch(self, listing_ids):
+        Watch = User.watchlist.through
+        # The (user, listing) pair is unique, so listings already watched are skipped.
+        Watch.objects.bulk_create([Watch(user_id=self.pk, listing_id=pk) for pk in listing_ids],
+                                  ignore_conflicts=True)
+        self.watchlist_changed()
+
+    def unwatch(self, listing_ids):
+        User.watchlist.through.objects.filter(user=self.pk, listing__in=listing_ids).delete()
+        self.watchlist_changed()
+
+    def watchlist_changed(self):
+        User.objects.filter(pk=self.pk).update(watchlist_version=F("watchlist_version") + 1)
+        self.watchlist_version += 1
+
+def unread_count_expression():
+    unread = (Notification.objects.filter(user=OuterRef("pk"), seen=False).order_by()
+              .values("user").annotate(count=Count("pk")).values("count"))
+    return Coalesce(Subquery(unread), 0)
+
+def active_listings_expression():
+    active = (Listing.objects.filter(category=OuterRef("pk"), active=True).order_by()
+              .values("category").annotate(count=Count("pk")).values("count"))
+    return Coalesce(Subquery(active), 0)
+
+class CategoryQuerySet(models.QuerySet):
+    def add_active_listings(self, changes):
+        """Apply {category id: change} to the active listing counters."""
+        from . import catalog
+
+        by_change = defaultdict(list)
+        for category, change in changes.items():
+            if category and change:
+                by_change[change].append(category)
+        for change, categories in by_change.items():
+            self.filter(pk__in=categories).update(active_listings=F("active_listings") + change)
+        if by_change:
+            catalog.changed([category for categories in by_change.values() for category in categories])
+
+class Category(MaintainedFieldsMixin, models.Model):
+    MAINTAINED_FIELDS = ("active_listings",)
 
-class Category(models.Model):
     name = models.CharField(max_length=32, unique=True)
+    # Open listings in the category, kept up to date by Listing.save() and the
+    # auction closer so the catalog never has to count them.
+    active_listings = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.name}"
 
-class Listing(models.Model):
+def bid_summary_expressions():
+    top_bid = Bid.objects.filter(listing=OuterRef("pk")).order_by("-value", "id")
+    bid_count = (Bid.objects.filter(listing=OuterRef("pk")).order_by()
+                 .values("listing").annotate(count=Count("pk")).values("count"))
+    return {
+        "current_price": Coalesce(Subquery(top_bid.values("value")[:1]), F("starting_price")),
+        "bid_count": Coalesce(Subquery(bid_count), 0),
+        "leading_bid": Subquery(top_bid.values("pk")[:1]),
+        "leading_user": Subquery(top_bid.values("user")[:1]),
+    }
+
+# Columns read by listing cards (see listing_info.html and ListingQuerySet.cards()).
+CARD_FIELDS = (
+    "title", "photo", "photo_variants_for", "datetime", "active", "ends_at", "current_price",
+    "bid_count", "version", "category", "owner", "category__name", "owner__username",
+)
+CARD_DESCRIPTION_LENGTH = 200
+
+class ListingQuerySet(models.QuerySet):
+    def with_bid_summary(self):
+        return self.annotate(**{
+            f"actual_{name}": expression
+            for name, expression in bid_summary_expressions().items()
+        })
+
+    def refresh_bid_summary(self):
+        return self.update(version=F("version") + 1, **bid_summary_expressions())
+
+    def expired(self, now=None):
+        return self.filter(active=True, ends_at__lte=now or timezone.now())
+
+    def cards(self, comment_count=False):
+        """Just what a listing card shows, with the related rows it needs, in one query.
+
+        The description is cut to `card_description` in the database and the
+        full column, like every other field cards don't show, is left unread.
+        Pass comment_count=True for pages that also show how many comments
+        each listing has.
+        """
+        cards = self.select_related("owner", "category").only(*CARD_FIELDS).annotate(
+            card_description=Substr("description", 1, CARD_DESCRIPTION_LENGTH + 1))
+        if comment_count:
+            comments = (Comment.objects.filter(listing=OuterRef("pk")).order_by()
+                        .values("listing").annotate(count=Count("pk")).values("count"))
+            cards = cards.annotate(comment_count=Coalesce(Subquery(comments), 0))
+        return cards
+
+    def bid_on_by(self, user):
+        """One row per listing `user` bid on, with their highest and latest bid.
+
+        Filtering and aggregating over the same join counts only the user's
+        bids; price and leader come from the maintained bid summary.
+        """
+        return self.filter(bids__user=user).annotate(
+            my_bid=Max("bids__value"),
+            last_bid_at=Max("bids__datetime"),
+            leading=ExpressionWrapper(Q(leading_user=user.pk), output_field=BooleanField()),
+        )
+
+class Listing(MaintainedFieldsMixin, models.Model):
+    # Maintained by record_bid() so pages never have to look up the highest bid.
+    BID_SUMMARY_FIELDS = ("current_price", "bid_count", "leading_bid", "leading_user")
+    # Bumped on every change, so it can key caches of anything rendered from the row.
+    MAINTAINED_FIELDS = BID_SUMMARY_FIELDS + ("version", "photo_variants_for")
+
     title = models.CharField(max_length=64)
     description = models.CharField(max_length=1000)
     starting_price = models.IntegerField(validators=[
         MinValueValidator(1)
     ])
     # photo = models.URLField(max_length=1000, null=True, default=None, blank=True)
-    photo = models.ImageField(upload_to="listings", default=None)
+    photo = models.ImageField(upload_to="listings", default=None, storage=storage.photo_storage)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, related_name="listings", null=True)
     owner = models.ForeignKey(User,related_name="listings", on_delete=models.CASCADE)
     active = models.BooleanField(default=True)
     datetime = models.DateTimeField(default=datetime(2021, 9, 12))
+    # Optional scheduled end; the close_expired_auctions command closes the listing.
+    ends_at = models.DateTimeField(null=True, blank=True)
+    current_price = models.IntegerField(default=0, editable=False)
+    bid_count = models.IntegerField(default=0, editable=False)
+    leading_bid = models.ForeignKey('Bid', on_delete=models.SET_NULL, related_name="+", null=True, editable=False)
+    leading_user = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="leading_listings", null=True, editable=False)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Name of the photo whose resized variants (see auctions.images) are stored.
+    photo_variants_for = models.CharField(max_length=100, blank=True, default="", editable=False)
+
+    objects = ListingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-datetime", "-id"], condition=Q(active=True),
+                         name="listing_active_recent_idx"),
+            models.Index(fields=["category", "-datetime", "-id"], condition=Q(active=True),
+                         name="listing_category_recent_idx"),
+            models.Index(fields=["owner", "-datetime", "-id"], name="listing_owner_recent_idx"),
+            models.Index(fields=["ends_at", "id"], condition=Q(active=True, ends_at__isnull=False),
+                         name="listing_ending_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so a replaced photo can release its stored blob, and so
+        # closing a listing can be announced to its watchers.
+        instance._loaded_photo = instance.__dict__.get("photo")
+        instance._loaded_active = instance.__dict__.get("active")
+        instance._loaded_category = instance.__dict__.get("category_id")
+        return instance
 
     def highest_bid(self):
         return self.bids.order_by("-value").first()
 
+    @property
+    def is_open(self):
+        # A listing past its end stops taking bids before the scheduler closes it.
+        return self.active and (self.ends_at is None or self.ends_at > timezone.now())
+
+    @property
+    def has_photo_variants(self):
+        return bool(self.photo) and self.photo_variants_for == self.photo.name
+
+    def photo_variant_url(self, variant):
+        return self.photo.storage.url(images.variant_name(self.photo.name, variant))
+
+    @property
+    def photo_card_url(self):
+        return self.photo_variant_url("card")
+
+    @property
+    def photo_card_2x_url(self):
+        return self.photo_variant_url("card-2x")
+
+    @property
+    def photo_detail_url(self):
+        return self.photo_variant_url("detail")
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            if not self.bid_count:
+                self.current_price = self.starting_price
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if self.active:
+                    Category.objects.add_active_listings({self.category_id: 1})
+            self._loaded_category = self.category_id
+            return
+        self.exclude_maintained_fields(kwargs)
+        with transaction.atomic():
+            if {"active", "category"} & set(kwargs["update_fields"]):
+                self.move_active_listing()
+            super().save(*args, **kwargs)
+            Listing.objects.filter(pk=self.pk).update(
+                version=F("version") + 1,
+                current_price=Case(When(bid_count=0, then=F("starting_price")),
+                                   default=F("current_price")),
+            )
+
+    def move_active_listing(self):
+        loaded = (getattr(self, "_loaded_active", None), getattr(self, "_loaded_category", None))
+        current = (self.active, self.category_id)
+        if loaded[0] is None or loaded == current:
+            return
+        # Compare-and-set, so a listing closed concurrently by the auction
+        # closer is only taken off its category's count once.
+        if Listing.objects.filter(pk=self.pk, active=loaded[0], category=loaded[1]).update(
+                active=current[0], category=current[1]):
+            changes = defaultdict(int)
+            changes[loaded[1]] -= loaded[0]
+            changes[current[1]] += current[0]
+            Category.objects.add_active_listings(changes)
+        self._loaded_category = self.category_id
+
+    def record_bid(self, bid):
+        # Compare-and-set: only succeeds if the bid still outbids the row as
+        # it is at write time, so concurrent bidders cannot both win a price.
+        outbids = Q(bid_count=0, starting_price__lte=bid.value) | Q(current_price__lt=bid.value)
+        running = Q(ends_at__isnull=True) | Q(ends_at__gt=timezone.now())
+        return Listing.objects.filter(outbids, running, pk=self.pk, active=True).update(
+            current_price=bid.value,
+            bid_count=F("bid_count") + 1,
+            leading_bid=bid.pk,
+            leading_user=bid.user_id,
+            version=F("version") + 1,
+        ) == 1
+
     def __str__(self):
         return f"{self.owner}'s '{self.title}'"
 
@@ -45,34 +311,171 @@ class Comment(models.Model):
     datetime = models.DateTimeField(default=datetime(2021, 9, 12))
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="comments")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["listing", "-datetime"], name="comment_listing_recent_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The listing page shows its comments, so they count as a change to it.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Listing.objects.filter(pk=self.listing_id).update(version=F("version") + 1)
+
     def __str__(self):
         return f"{self.user}: '{self.text[0:32]}' at {self.listing}"
 
 
+class StaleBid(Exception):
+    pass
+
 class Bid(models.Model):
     value = models.IntegerField()
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bids")
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="bids")
     datetime = models.DateTimeField(default=datetime(2021, 9, 12))
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["listing", "-value"], name="bid_listing_value_idx"),
+            models.Index(fields=["user", "-datetime", "-id"], name="bid_user_recent_idx"),
+        ]
+
     def clean(self):
-        highest_bid = self.listing.highest_bid()
-        if highest_bid:
-            if self.value <= highest_bid.value:
+        if self.listing.bid_count:
+            if self.value <= self.listing.current_price:
                 raise ValidationError(_('Your bid must be higher than the current one.'))
         else:
             if self.value < self.listing.starting_price:
                 raise ValidationError(_('Your bid must not be lower than the starting one.'))
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                if not self.listing.record_bid(self):
+                    raise StaleBid(f"{self} no longer outbids {self.listing}")
+            else:
+                Listing.objects.filter(pk=self.listing_id).refresh_bid_summary()
+
     def __str__(self):
         return f"${self.value} by {self.user} at {self.listing}"
 
+class NotificationQuerySet(models.QuerySet):
+    def mark_seen(self):
+        with transaction.atomic():
+            unseen = self.filter(seen=False)
+            users = list(unseen.order_by().values_list("user", flat=True).distinct())
+            updated = unseen.update(seen=True)
+            User.objects.filter(pk__in=users).update(unread_count=unread_count_expression())
+        return updated
+
 class Notification(models.Model):
+    OUTBID = "outbid"
+    WON = "won"
+    CLOSED = "closed"
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
     text = models.CharField(max_length=200)
     datetime = models.DateTimeField(default=datetime(2021, 9, 12))
     url = models.CharField(null=True, max_length=20)
     seen = models.BooleanField(default=False)
+    # Set on notifications sent by auctions.notify, which keeps at most one
+    # unread notification of each kind per user and listing.
+    listing = models.ForeignKey(Listing, on_delete=models.SET_NULL, related_name="notifications", null=True)
+    kind = models.CharField(max_length=8, blank=True, default="")
+
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user"], condition=Q(seen=False), name="notification_unseen_idx"),
+            models.Index(fields=["user", "-datetime", "-id"], name="notification_user_recent_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["listing", "kind", "user"], condition=Q(seen=False),
+                                    name="notification_unread_once"),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding and not self.seen:
+                User.objects.filter(pk=self.user_id).update(unread_count=F("unread_count") + 1)
+
+    def mark_seen(self):
+        with transaction.atomic():
+            if Notification.objects.filter(pk=self.pk, seen=False).update(seen=True):
+                User.objects.filter(pk=self.user_id, unread_count__gt=0).update(
+                    unread_count=F("unread_count") - 1)
+        self.seen = True
+
+    def __str__(self):
+        return f"{self.text}"
+
+class PhotoBlobQuerySet(models.QuerySet):
+    def acquire(self, name, size, count=1):
+        if not self.filter(name=name).update(references=F("references") + count, released=None):
+            try:
+                with transaction.atomic():
+                    self.create(name=name, size=size, references=count)
+            except IntegrityError:
+                self.filter(name=name).update(references=F("references") + count, released=None)
+
+    def release(self, name):
+        self.filter(name=name, references__gt=0).update(
+            references=F("references") - 1,
+            released=Case(When(references=1, then=Value(timezone.now())), default=F("released")),
+        )
+
+
+class PhotoBlob(models.Model):
+    """A file in ContentAddressedStorage and the number of listings using it."""
+    name = models.CharField(max_length=100, unique=True)
+    size = models.PositiveIntegerField(default=0)
+    references = models.PositiveIntegerField(default=0)
+    released = models.DateTimeField(null=True, blank=True)
+
+    objects = PhotoBlobQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.name} ({self.references} reference(s))"
+
+
+class Job(models.Model):
+    """A unit of background work, run by the run_jobs worker (see auctions.jobs)."""
+    QUEUED = "queued"
+    FAILED = "failed"
+
+    task = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=8, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Queued jobs become visible to workers at run_at. Claiming a job pushes
+    # it forward by the visibility timeout, so a job whose worker died is
+    # picked up again once that runs out.
+    run_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True, default="")
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["run_at"], condition=Q(status="queued"), name="job_ready_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task}({self.payload}) [{self.status}]"
+
+
+class PageStamp(models.Model):
+    """How often, and when last, a feed page changed (see auctions.stamps)."""
+    key = models.CharField(max_length=64, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField()
 
     def __str__(self):
-        return f"{self.text}"
\ No newline at end of file
+        return f"{self.key} v{self.version}"
@@ -0,0 +1,67 @@
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from .models import Bid, Listing, Notification, User, unread_count_expression
+
+
+BATCH_SIZE = 500
+
+
+def fan_out(listing_id, kind, user_ids, text, now=None):
+    """Give each user one unread notification of `kind` about a listing.
+
+    Users who still have an unread one get it refreshed instead of a second
+    one. Runs a fixed three statements per batch of users, however many
+    there are.
+    """
+    now = now or timezone.now()
+    text = Truncator(text).chars(Notification._meta.get_field("text").max_length)
+    url = reverse("listing", args=[listing_id])
+    users = sorted(set(user_ids))
+    for start in range(0, len(users), BATCH_SIZE):
+        batch = users[start:start + BATCH_SIZE]
+        with transaction.atomic():
+            Notification.objects.filter(
+                listing_id=listing_id, kind=kind, seen=False, user__in=batch,
+            ).update(text=text, datetime=now)
+            # Conflicts with the unread notifications just refreshed are skipped
+            # (see the notification_unread_once constraint).
+            Notification.objects.bulk_create([
+                Notification(user_id=user, listing_id=listing_id, kind=kind, text=text, url=url, datetime=now)
+                for user in batch
+            ], ignore_conflicts=True)
+            User.objects.filter(pk__in=batch).update(unread_count=unread_count_expression())
+    return len(users)
+
+
+def notify_outbid(bid_id):
+    bid = Bid.objects.select_related("listing__owner").filter(pk=bid_id).first()
+    if bid is None:
+        return 0
+    # Only the previous leader is newly outbid; earlier bidders already were.
+    previous = (Bid.objects.filter(listing=bid.listing_id, value__lt=bid.value)
+                .order_by("-value").values_list("user", flat=True).first())
+    if previous is None or previous == bid.user_id:
+        return 0
+    return fan_out(bid.listing_id, Notification.OUTBID, [previous],
+                   f"You have been outbid on {bid.listing}: the price is now ${bid.value}.")
+
+
+def notify_winner(listing_id):
+    listing = Listing.objects.select_related("owner").get(pk=listing_id)
+    if not listing.leading_user_id:
+        return 0
+    return fan_out(listing.id, Notification.WON, [listing.leading_user_id],
+                   f"Congratulations! You won the bid {listing}!")
+
+
+def notify_watchers(listing_id):
+    listing = Listing.objects.select_related("owner").get(pk=listing_id)
+    watchers = (listing.users_watching.exclude(pk=listing.owner_id).order_by()
+                .values_list("pk", flat=True))
+    if listing.leading_user_id:
+        watchers = watchers.exclude(pk=listing.leading_user_id)
+    return fan_out(listing.id, Notification.CLOSED, watchers,
+                   f"{listing} you are watching has closed at ${listing.current_price}.")
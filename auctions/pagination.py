@@ -0,0 +1,121 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+PAGE_SIZE = 24
+
+NEXT = "n"
+PREVIOUS = "p"
+
+
+def encode_cursor(direction, value, pk):
+    # Keys are datetimes, or numbers such as search ranks (repr() round-trips).
+    value = value.isoformat() if hasattr(value, "isoformat") else repr(float(value))
+    raw = f"{direction}|{value}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_value(text):
+    value = parse_datetime(text)
+    return float(text) if value is None else value
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        direction, value, pk = raw.split("|")
+        value = decode_value(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if direction not in (NEXT, PREVIOUS) or value is None:
+        return None
+    return direction, value, pk
+
+
+class CursorPage:
+    def __init__(self, request, items, next_cursor=None, previous_cursor=None, path=None):
+        self.request = request
+        self.path = path
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def _url(self, cursor):
+        if self.path:
+            return f"{self.path}?cursor={cursor}"
+        params = self.request.GET.copy()
+        params["cursor"] = cursor
+        return f"{self.request.path}?{params.urlencode()}"
+
+    @property
+    def has_other_pages(self):
+        return bool(self.next_cursor or self.previous_cursor)
+
+    @property
+    def next_url(self):
+        return self._url(self.next_cursor) if self.next_cursor else None
+
+    @property
+    def previous_url(self):
+        return self._url(self.previous_cursor) if self.previous_cursor else None
+
+
+def paginate(request, queryset, field="datetime", per_page=PAGE_SIZE, path=None):
+    """Return the page of `queryset` selected by the request's `cursor`.
+
+    Rows are ordered newest first by (`field`, id) and pages are found by
+    seeking past the cursor's key, so every page costs the same single query
+    no matter how deep it is. With `path`, the request's cursor is ignored
+    and the first page links to further pages at `path` instead, e.g. a
+    fragment endpoint serving the rest of a list embedded in a page.
+    """
+    cursor = None if path else decode_cursor(request.GET.get("cursor", ""))
+    if cursor is None:
+        direction, key = NEXT, None
+    else:
+        direction, key = cursor[0], cursor[1:]
+
+    if direction == NEXT:
+        if key:
+            queryset = queryset.filter(
+                Q(**{f"{field}__lt": key[0]}) | Q(**{field: key[0], "pk__lt": key[1]})
+            )
+        queryset = queryset.order_by(f"-{field}", "-pk")
+    else:
+        queryset = queryset.filter(
+            Q(**{f"{field}__gt": key[0]}) | Q(**{field: key[0], "pk__gt": key[1]})
+        ).order_by(field, "pk")
+
+    items = list(queryset[:per_page + 1])
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == PREVIOUS:
+        items.reverse()
+    if not items:
+        return CursorPage(request, items, path=path)
+
+    def cursor_at(direction, item):
+        if isinstance(item, dict):  # rows from .values(), which must include `field` and "pk"
+            return encode_cursor(direction, item[field], item["pk"])
+        return encode_cursor(direction, getattr(item, field), item.pk)
+
+    if direction == NEXT:
+        next_cursor = cursor_at(NEXT, items[-1]) if has_more else None
+        previous_cursor = cursor_at(PREVIOUS, items[0]) if key else None
+    else:
+        next_cursor = cursor_at(NEXT, items[-1])
+        previous_cursor = cursor_at(PREVIOUS, items[0]) if has_more else None
+    return CursorPage(request, items, next_cursor, previous_cursor, path=path)
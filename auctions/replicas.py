@@ -0,0 +1,96 @@
+import contextvars
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Reads go to the primary unless a view opts in with @replica_reads. A
+# visitor who has just written is kept on the primary for
+# REPLICA_STICKY_SECONDS, long enough for replicas to catch up, so they
+# always see their own bids and comments.
+STICKY_COOKIE = "primary_until"
+
+
+class RequestState:
+    def __init__(self):
+        # The replica this request reads from, if any; one per request so
+        # its reads agree with each other.
+        self.replica = None
+        self.wrote = False
+
+
+_state = contextvars.ContextVar("database_routing", default=None)
+
+
+def replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def is_sticky(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def replica_reads(view):
+    """Send the reads of a view's GET and HEAD requests to a replica."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = _state.get()
+        if request.method not in ("GET", "HEAD") or not replicas() or is_sticky(request) or state is None:
+            return view(request, *args, **kwargs)
+        state.replica = random.choice(replicas())
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.replica = None
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (state is None or not state.replica or state.wrote
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # Related rows come from wherever the instance did.
+            return instance._state.db
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class StickyPrimaryMiddleware:
+    """Tracks writes per request and pins their author to the primary for a while."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RequestState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote and replicas():
+            until = time.time() + settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, f"{until:.0f}", max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
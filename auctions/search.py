@@ -0,0 +1,111 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Listing
+
+
+# Created by migration 0031: an FTS5 table kept in sync by triggers on SQLite,
+# a generated tsvector column on PostgreSQL.
+FTS_TABLE = "auctions_listing_fts"
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_TERMS = 10
+
+SQLITE_TABLE = f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    title, description, content='auctions_listing', content_rowid='id',
+    tokenize='porter unicode61 remove_diacritics 2'
+)"""
+SQLITE_TRIGGERS = {
+    f"{FTS_TABLE}_insert": f"""AFTER INSERT ON auctions_listing BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+    f"{FTS_TABLE}_delete": f"""AFTER DELETE ON auctions_listing BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    f"{FTS_TABLE}_update": f"""AFTER UPDATE OF title, description ON auctions_listing BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+}
+
+
+def install_sqlite_index(connection):
+    """Create the FTS5 table and triggers where missing, returning whether any were.
+
+    Migrations that alter the listing table drop its triggers on SQLite, so
+    this runs after every migrate (see signals).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)"
+            % ", ".join(["%s"] * len(SQLITE_TRIGGERS)),
+            list(SQLITE_TRIGGERS),
+        )
+        if len(cursor.fetchall()) == len(SQLITE_TRIGGERS):
+            return False
+        cursor.execute(SQLITE_TABLE)
+        for name, body in SQLITE_TRIGGERS.items():
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def terms(query):
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+def sqlite_match(words):
+    # The last word may be a prefix, as the user may still be typing it.
+    return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+
+def sqlite_search(queryset, words):
+    # The index is joined once, so bm25() ranks the rows of the same match.
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f"{FTS_TABLE}.rowid = auctions_listing.id", f"{FTS_TABLE} MATCH %s"],
+        params=[sqlite_match(words)],
+    ).annotate(rank=RawSQL(
+        # bm25() is lower for better matches; negated so higher ranks first.
+        f"-bm25({FTS_TABLE}, %s, %s)", [TITLE_WEIGHT, DESCRIPTION_WEIGHT], output_field=FloatField(),
+    ))
+
+
+def postgresql_search(queryset, words):
+    query = " & ".join(words[:-1] + [f"{words[-1]}:*"])
+    return queryset.filter(RawSQL(
+        "auctions_listing.search_vector @@ to_tsquery('english', %s)",
+        [query], output_field=BooleanField(),
+    )).annotate(rank=RawSQL(
+        "ts_rank(auctions_listing.search_vector, to_tsquery('english', %s))",
+        [query], output_field=FloatField(),
+    ))
+
+
+def fallback_search(queryset, words):
+    condition = Q()
+    for word in words:
+        condition &= Q(title__icontains=word) | Q(description__icontains=word)
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+BACKENDS = {
+    "sqlite": sqlite_search,
+    "postgresql": postgresql_search,
+}
+
+
+def search_listings(query, queryset=None):
+    """Return the listings matching every word of `query`, annotated with a `rank`."""
+    queryset = Listing.objects.all() if queryset is None else queryset
+    words = terms(query)
+    if not words:
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+    return BACKENDS.get(connection.vendor, fallback_search)(queryset, words)
@@ -0,0 +1,161 @@
+import threading
+
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from django.template.defaultfilters import date
+from django.utils.timezone import template_localtime
+
+from . import catalog, events, jobs, search, stamps
+from .models import Bid, Category, Comment, Listing, Notification, User
+
+
+# Listings this thread is deleting. Their bids and comments are deleted with
+# them, so those rows skip their own bookkeeping: the listing's is done once.
+_deleting = threading.local()
+
+
+def being_deleted(listing_id):
+    return listing_id in getattr(_deleting, "listings", ())
+
+
+@receiver(post_save, sender=Listing)
+def count_photo_references(sender, instance, created, **kwargs):
+    # In the listing's transaction, so a save that fails takes no reference.
+    storage = instance.photo.storage
+    loaded = None if created else getattr(instance, "_loaded_photo", None)
+    if loaded != instance.photo.name and hasattr(storage, "acquire"):
+        if instance.photo.name:
+            storage.acquire(instance.photo.name)
+        if loaded:
+            storage.release(loaded)
+    instance._loaded_photo = instance.photo.name
+
+
+@receiver(post_delete, sender=Listing)
+def release_deleted_photo(sender, instance, **kwargs):
+    if instance.photo.name and hasattr(instance.photo.storage, "release"):
+        instance.photo.storage.release(instance.photo.name)
+
+
+@receiver(post_save, sender=Listing)
+def announce_closed_listing(sender, instance, created, **kwargs):
+    if getattr(instance, "_loaded_active", None) and not instance.active:
+        events.publish(instance.pk, "closed", {
+            "current_price": instance.current_price,
+            "bid_count": instance.bid_count,
+            "active": False,
+        })
+    instance._loaded_active = instance.active
+
+
+@receiver(post_save, sender=Bid)
+def announce_bid(sender, instance, created, **kwargs):
+    if created:
+        # Same transaction as the bid, so a rejected bid notifies nobody.
+        jobs.enqueue("notify_outbid", bid_id=instance.pk)
+        # An accepted bid is the new price; watchers count it themselves.
+        events.publish(instance.listing_id, "bid", {"id": instance.pk, "value": instance.value})
+    else:
+        # Edited in the admin: watchers look the listing up again.
+        events.publish(instance.listing_id, "changed", {})
+
+
+@receiver(post_delete, sender=Bid)
+def announce_deleted_bid(sender, instance, **kwargs):
+    if not being_deleted(instance.listing_id):
+        events.publish(instance.listing_id, "changed", {})
+
+
+@receiver(post_save, sender=Comment)
+def announce_comment(sender, instance, created, **kwargs):
+    if created:
+        events.publish(instance.listing_id, "comment", {
+            "id": instance.pk,
+            "user": str(instance.user),
+            "text": instance.text,
+            "datetime": date(template_localtime(instance.datetime), "m.d.Y g:iA"),
+        })
+
+
+@receiver(post_save, sender=Listing)
+def touch_listing(sender, instance, **kwargs):
+    stamps.touch_listing(instance.pk, instance.category_id)
+
+
+@receiver(post_delete, sender=Listing)
+def touch_deleted_listing(sender, instance, **kwargs):
+    stamps.touch_listing(instance.pk, instance.category_id)
+    getattr(_deleting, "listings", set()).discard(instance.pk)
+
+
+@receiver(post_save, sender=Bid)
+def touch_bid_listing(sender, instance, **kwargs):
+    # Feeds show the price, so they change with the listing.
+    stamps.touch_listing(instance.listing_id, instance.listing.category_id)
+
+
+@receiver(post_delete, sender=Bid)
+def refresh_deleted_bid_listing(sender, instance, **kwargs):
+    # Also for queryset deletes and cascades, e.g. from deleting the bidder.
+    if not being_deleted(instance.listing_id):
+        listing = Listing.objects.filter(pk=instance.listing_id)
+        listing.refresh_bid_summary()
+        stamps.touch_listing(instance.listing_id, listing.values_list("category", flat=True).first())
+
+
+@receiver(post_delete, sender=Comment)
+def change_commented_listing(sender, instance, **kwargs):
+    # The listing page shows its comments, however they are deleted.
+    if not being_deleted(instance.listing_id):
+        Listing.objects.filter(pk=instance.listing_id).update(version=F("version") + 1)
+
+
+@receiver(post_delete, sender=Notification)
+def count_deleted_notification(sender, instance, **kwargs):
+    # Also for queryset deletes, e.g. the admin's, and cascades.
+    if not instance.seen:
+        User.objects.filter(pk=instance.user_id, unread_count__gt=0).update(
+            unread_count=F("unread_count") - 1)
+
+
+@receiver(pre_delete, sender=Listing)
+def count_deleted_listing(sender, instance, **kwargs):
+    if not hasattr(_deleting, "listings"):
+        _deleting.listings = set()
+    _deleting.listings.add(instance.pk)
+    # The instance may be stale, e.g. closed by the auction closer since it
+    # was loaded, so the row decides; the update locks it until the delete.
+    if Listing.objects.filter(pk=instance.pk, active=True).update(active=False):
+        category = Listing.objects.filter(pk=instance.pk).values_list("category", flat=True).get()
+        Category.objects.add_active_listings({category: -1})
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reload_catalog(sender, instance, **kwargs):
+    catalog.changed([instance.pk])
+
+
+@receiver(post_migrate)
+def reinstall_search_index(sender, using, **kwargs):
+    connection = connections[using]
+    if (sender.name == "auctions" and connection.vendor == "sqlite"
+            and Listing._meta.db_table in connection.introspection.table_names()):
+        search.install_sqlite_index(connection)
+
+
+@receiver(m2m_changed, sender=User.watchlist.through)
+def bump_watchlist_version(sender, instance, action, reverse, pk_set, **kwargs):
+    # Covers changes made through the related managers, e.g. in the admin.
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            instance.watchlist_changed()
+        return
+    if action == "pre_clear":
+        instance._cleared_watchers = list(instance.users_watching.values_list("pk", flat=True))
+    elif action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_watchers", [])
+    if action in ("post_add", "post_remove", "post_clear") and pk_set:
+        User.objects.filter(pk__in=pk_set).update(watchlist_version=F("watchlist_version") + 1)
@@ -0,0 +1,152 @@
+from collections import namedtuple
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+
+# Version stamps let pages answer conditional GETs before running their
+# queries. A listing page follows Listing.version; each feed has a PageStamp
+# row, bumped in the same transaction as every change shown on it.
+Stamp = namedtuple("Stamp", "version modified ends_at", defaults=(None,))
+
+
+def index_key():
+    return "feed:index"
+
+
+def category_key(category_id):
+    return f"feed:category:{category_id}"
+
+
+def catalog_key():
+    # Every feed shows the categories with their counts.
+    return "feed:catalog"
+
+
+def load(key):
+    from .models import PageStamp
+
+    row = PageStamp.objects.filter(key=key).values_list("version", "modified").first()
+    return Stamp(*row) if row else Stamp(0, None)
+
+
+def load_combined(*keys):
+    from .models import PageStamp
+
+    rows = {key: Stamp(version, modified) for key, version, modified in
+            PageStamp.objects.filter(key__in=keys).values_list("key", "version", "modified")}
+    return Stamp(".".join(str(rows[key].version if key in rows else 0) for key in keys),
+                 max((stamp.modified for stamp in rows.values()), default=None))
+
+
+def load_listing(listing_id):
+    from .models import Listing
+
+    row = Listing.objects.filter(pk=listing_id).values("version", "active", "ends_at").first()
+    if row is None:
+        return Stamp("missing", None)
+    # The page changes once a scheduled end passes, before the listing is closed.
+    return Stamp(row["version"], None, row["ends_at"] if row["active"] else None)
+
+
+def bump(*keys):
+    """Mark `keys` changed as part of the current transaction."""
+    from .models import PageStamp
+
+    now = timezone.now()
+    ordered = sorted(set(keys))
+    with transaction.atomic(savepoint=False):
+        # New rows start a second back, so the update below brings them to now.
+        PageStamp.objects.bulk_create(
+            [PageStamp(key=key, modified=now - timedelta(seconds=1)) for key in ordered],
+            ignore_conflicts=True)
+        # Last-Modified has whole-second precision.
+        PageStamp.objects.filter(key__in=ordered).update(
+            version=F("version") + 1,
+            modified=Greatest(Value(now), F("modified") + timedelta(seconds=1)))
+
+
+def touch_listing(listing_id, category_id=None):
+    """Mark the feeds showing a listing changed; its own page follows Listing.version."""
+    touch_listings([(listing_id, category_id)])
+
+
+def touch_listings(listings):
+    """Like touch_listing(), for (listing id, category id) pairs, in one go."""
+    bump(index_key(), *[category_key(category_id) for listing_id, category_id in listings if category_id])
+
+
+def touch_categories(category_ids):
+    """Mark the categories, and so every feed listing them, changed."""
+    bump(index_key(), catalog_key(), *[category_key(pk) for pk in category_ids])
+
+
+def touch_feeds():
+    """Mark every feed changed, after changes to listings in bulk."""
+    bump(index_key(), catalog_key())
+
+
+def request_stamp(request, key, load):
+    # The ETag and Last-Modified functions both ask; look up once per request.
+    stamps = request.__dict__.setdefault("_stamps", {})
+    if key not in stamps:
+        stamps[key] = load()
+    return stamps[key]
+
+
+def viewer(request):
+    # Pages differ per user, and a 304 never sets the CSRF cookie their forms need.
+    csrf = "c" if settings.CSRF_COOKIE_NAME in request.COOKIES else "n"
+    user = request.user
+    if not user.is_authenticated:
+        return f"anon{csrf}"
+    return f"u{user.pk}.{user.unread_count}.{user.watchlist_version}{csrf}"
+
+
+def etag(request, key, load):
+    stamp = request_stamp(request, key, load)
+    ended = "e" if stamp.ends_at and stamp.ends_at <= timezone.now() else ""
+    return f"{stamp.version}{ended}-{viewer(request)}"
+
+
+def last_modified(request, key, load):
+    # A signed-in user's own changes have no time, so they are left to the ETag.
+    if request.user.is_authenticated:
+        return None
+    return request_stamp(request, key, load).modified
+
+
+def listing_etag(request, id):
+    # The version has no time, so listing pages have no Last-Modified.
+    return etag(request, f"listing:{id}", partial(load_listing, id))
+
+
+def index_etag(request):
+    return etag(request, index_key(), partial(load, index_key()))
+
+
+def index_last_modified(request):
+    return last_modified(request, index_key(), partial(load, index_key()))
+
+
+def category_id(request, name):
+    from . import catalog
+
+    category = catalog.get(name)
+    return category and category.pk
+
+
+def category_etag(request, name):
+    # Unknown categories get no validators, so creating one is seen at once.
+    pk = category_id(request, name)
+    return pk and etag(request, category_key(pk), partial(load_combined, category_key(pk), catalog_key()))
+
+
+def category_last_modified(request, name):
+    pk = category_id(request, name)
+    return pk and last_modified(request, category_key(pk), partial(load_combined, category_key(pk), catalog_key()))
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+
+# Matches names produced by ContentAddressedStorage, and the photo variants
+# derived from them, which never change once written.
+BLOB_NAME = re.compile(r"^(?:[\w-]+/)*[0-9a-f]{2}/[0-9a-f]{64}[\w.-]*$")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names every file after the SHA-256 of its content.
+
+    Identical uploads are stored once as <dir>/<ab>/<abcdef...>.<ext>. Listings
+    take a reference on their blob (see PhotoBlob) with acquire() and drop it
+    with release(), in the transaction that saves them; the collect_photo_blobs
+    command removes blobs nobody references, including uploads whose listing
+    was never saved.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def blob_name(self, directory, digest, extension):
+        return os.path.join(directory, digest[:2], f"{digest}{extension.lower()}").replace("\\", "/")
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        os.makedirs(self.location, exist_ok=True)
+        digest, size = hashlib.sha256(), 0
+        fd, temp_path = tempfile.mkstemp(dir=self.location, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    temp.write(chunk)
+            name = self.blob_name(directory, digest.hexdigest(), os.path.splitext(filename)[1])
+            path = self.path(name)
+            if os.path.exists(path):
+                # A fresh modification time keeps the blob from being collected
+                # before the listing being saved with it takes a reference.
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name
+
+    def acquire(self, name, count=1):
+        from .models import PhotoBlob
+
+        if BLOB_NAME.match(name):
+            PhotoBlob.objects.acquire(name, self.size(name) if self.exists(name) else 0, count)
+
+    def release(self, name):
+        from .models import PhotoBlob
+
+        PhotoBlob.objects.release(name)
+
+
+def photo_storage():
+    return get_storage_class(settings.PHOTO_STORAGE)()
+
+
+def serve_immutable(request, path, document_root=None):
+    """Serve a media file, letting clients cache content-addressed ones forever."""
+    response = serve(request, path, document_root=document_root)
+    if BLOB_NAME.match(path):
+        patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
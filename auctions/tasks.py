@@ -0,0 +1,16 @@
+from . import notify
+from .images import process_listing_photo
+from .jobs import task
+from .models import Listing
+
+
+@task("process_listing_photo")
+def listing_photo(listing_id):
+    listing = Listing.objects.filter(pk=listing_id).first()
+    if listing:
+        process_listing_photo(listing)
+
+
+task("notify_outbid")(notify.notify_outbid)
+task("notify_winner")(notify.notify_winner)
+task("notify_watchers")(notify.notify_watchers)
@@ -1,3 +1,1640 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import api, bidding, catalog, closing, events, images, jobs, models, notify, replicas, search, stamps, timing, views
+from .backends.sqlite3 import base as sqlite_backend
+from .pagination import decode_cursor, paginate
+from .storage import BLOB_NAME as STORAGE_BLOB_NAME, serve_immutable
+from .models import Bid, Category, Comment, Job, Listing, Notification, PhotoBlob, StaleBid, User
+
+
+class AuctionFixtures:
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        catalog.invalidate()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "password")
+        self.alice = User.objects.create_user("alice", "alice@example.com", "password")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "password")
+        self.category = Category.objects.create(name="Tech")
+        self.listing = self.create_listing()
+
+    def create_listing(self, **kwargs):
+        fields = {
+            "title": "Laptop",
+            "description": "A used laptop",
+            "starting_price": 10,
+            "photo": "listings/tech1.jpg",
+            "category": self.category,
+            "owner": self.owner,
+        }
+        fields.update(kwargs)
+        return Listing.objects.create(**fields)
+
+
+class AuctionTestCase(AuctionFixtures, TestCase):
+    pass
+
+
+class BidSummaryTests(AuctionTestCase):
+    def test_new_listing_starts_at_starting_price(self):
+        self.assertEqual(self.listing.current_price, 10)
+        self.assertEqual(self.listing.bid_count, 0)
+        self.assertIsNone(self.listing.leading_user)
+
+    def test_bids_update_summary(self):
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        second = Bid.objects.create(value=20, user=self.bob, listing=self.listing)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, 20)
+        self.assertEqual(self.listing.bid_count, 2)
+        self.assertEqual(self.listing.leading_bid, second)
+        self.assertEqual(self.listing.leading_user, self.bob)
+
+    def test_bid_that_no_longer_outbids_is_rolled_back(self):
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        with self.assertRaises(StaleBid):
+            Bid.objects.create(value=15, user=self.bob, listing=self.listing)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.bid_count, 1)
+        self.assertEqual(self.listing.bids.count(), 1)
+
+    def test_deleting_leading_bid_restores_previous_leader(self):
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        second = Bid.objects.create(value=20, user=self.bob, listing=self.listing)
+        second.delete()
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, 15)
+        self.assertEqual(self.listing.bid_count, 1)
+        self.assertEqual(self.listing.leading_user, self.alice)
+
+    def test_deleting_the_leader_restores_previous_leader(self):
+        Bid.objects.create(value=20, user=self.alice, listing=self.listing)
+        Bid.objects.create(value=30, user=self.bob, listing=self.listing)
+        self.bob.delete()
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.current_price, self.listing.bid_count), (20, 1))
+        self.assertEqual(self.listing.leading_user, self.alice)
+        Bid.objects.filter(listing=self.listing).delete()
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.current_price, self.listing.bid_count), (10, 0))
+        call_command("repair_bid_summaries", "--verify", stdout=StringIO())
+
+    def test_saving_stale_listing_keeps_summary(self):
+        stale = Listing.objects.get(pk=self.listing.pk)
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        stale.active = False
+        stale.save()
+        self.listing.refresh_from_db()
+        self.assertFalse(self.listing.active)
+        self.assertEqual(self.listing.current_price, 15)
+        self.assertEqual(self.listing.bid_count, 1)
+
+    def test_repair_command(self):
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        Listing.objects.update(bid_count=0, current_price=0, leading_bid=None, leading_user=None)
+        with self.assertRaises(CommandError):
+            call_command("repair_bid_summaries", "--verify", stdout=StringIO())
+        call_command("repair_bid_summaries", stdout=StringIO())
+        call_command("repair_bid_summaries", "--verify", stdout=StringIO())
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, 15)
+        self.assertEqual(self.listing.leading_user, self.alice)
+
+
+class PlaceBidTests(AuctionTestCase):
+    def test_accepted_bid_becomes_leader(self):
+        outcome = bidding.place_bid(self.listing, self.alice, 12)
+        self.assertTrue(outcome.accepted)
+        self.assertEqual(outcome.current_price, 12)
+        self.assertEqual(self.listing.leading_user, self.alice)
+
+    def test_rejections(self):
+        self.assertEqual(bidding.place_bid(self.listing, self.alice, 9).status, bidding.TOO_LOW)
+        self.assertEqual(bidding.place_bid(self.listing, self.owner, 50).status, bidding.FORBIDDEN)
+        self.assertTrue(bidding.place_bid(self.listing, self.alice, 10).accepted)
+        self.assertEqual(bidding.place_bid(self.listing, self.bob, 10).status, bidding.TOO_LOW)
+
+    def test_stale_listing_is_rejected(self):
+        stale = Listing.objects.get(pk=self.listing.pk)
+        self.assertTrue(bidding.place_bid(self.listing, self.alice, 20).accepted)
+        outcome = bidding.place_bid(stale, self.bob, 15)
+        self.assertEqual(outcome.status, bidding.STALE)
+        self.assertEqual(outcome.current_price, 20)
+        self.assertEqual(self.listing.bids.count(), 1)
+
+    def test_closed_listing_is_rejected(self):
+        stale = Listing.objects.get(pk=self.listing.pk)
+        Listing.objects.filter(pk=self.listing.pk).update(active=False)
+        self.assertEqual(bidding.place_bid(stale, self.bob, 15).status, bidding.CLOSED)
+
+    def test_view_reports_outcome(self):
+        self.client.force_login(self.alice)
+        url = reverse("listing", args=[self.listing.id])
+        response = self.client.post(url, {"place_bid": "Bid", "value": 12})
+        self.assertRedirects(response, url)
+        self.client.force_login(self.bob)
+        response = self.client.post(url, {"place_bid": "Bid", "value": 12})
+        self.assertContains(response, "Your bid must be higher than the current one.")
+
+
+class PaginationTests(AuctionTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        # Pairs of listings share a timestamp so the id tie-breaker matters.
+        for i in range(9):
+            self.create_listing(title=f"Listing {i}", datetime=now - timezone.timedelta(minutes=i // 2))
+        self.ordered = list(Listing.objects.order_by("-datetime", "-pk"))
+
+    def page(self, cursor=None):
+        request = RequestFactory().get("/", {"cursor": cursor} if cursor else {})
+        return paginate(request, Listing.objects.all(), per_page=4)
+
+    def test_walk_forward_and_back(self):
+        first = self.page()
+        self.assertIsNone(first.previous_cursor)
+        second = self.page(first.next_cursor)
+        third = self.page(second.next_cursor)
+        self.assertIsNone(third.next_cursor)
+        self.assertEqual(list(first) + list(second) + list(third), self.ordered)
+        self.assertEqual(list(self.page(second.previous_cursor)), list(first))
+        self.assertEqual(list(self.page(third.previous_cursor)), list(second))
+        self.assertIn("cursor=", second.next_url)
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        self.assertIsNone(decode_cursor("not a cursor"))
+        self.assertEqual(list(self.page("garbage")), self.ordered[:4])
+
+    def test_index_is_paginated(self):
+        response = self.client.get(reverse("index"))
+        self.assertEqual(len(response.context["listings"]), min(len(self.ordered), 24))
+        response = self.client.get(reverse("index"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(AuctionTestCase):
+    def search(self, **params):
+        return self.client.get(reverse("search_api"), params).json()
+
+    def titles(self, **params):
+        return [result["title"] for result in self.search(**params)["results"]]
+
+    def test_ranking_stemming_and_prefixes(self):
+        self.create_listing(title="Camera bag", description="Fits two cameras")
+        self.create_listing(title="Tripod", description="Works with any camera")
+        self.create_listing(title="Sofa", description="Comfortable")
+        self.assertEqual(self.titles(q="cameras"), ["Camera bag", "Tripod"])
+        self.assertEqual(self.titles(q="lapt"), ["Laptop"])
+        self.assertEqual(self.titles(q="used LAPTOP"), ["Laptop"])
+        self.assertEqual(self.titles(q="used sofa"), [])
+        self.assertEqual(self.titles(q='"(*'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.listing.title = "Desktop"
+        self.listing.save()
+        self.assertEqual(self.titles(q="laptop"), ["Desktop"])
+        self.assertEqual(self.titles(q="desktop"), ["Desktop"])
+        Listing.objects.filter(pk=self.listing.pk).update(description="A tower")
+        self.assertEqual(self.titles(q="laptop"), [])
+        self.listing.delete()
+        self.assertEqual(self.titles(q="desktop"), [])
+
+    def test_filters(self):
+        home = Category.objects.create(name="Home")
+        self.create_listing(title="Laptop stand", category=home)
+        closed = self.create_listing(title="Laptop bag")
+        closed.active = False
+        closed.save()
+        self.assertEqual(set(self.titles(q="laptop")), {"Laptop", "Laptop stand"})
+        self.assertEqual(self.titles(q="laptop", status="closed"), ["Laptop bag"])
+        self.assertEqual(len(self.titles(q="laptop", status="all")), 3)
+        self.assertEqual(self.titles(q="laptop", category="Home"), ["Laptop stand"])
+
+    def test_cursor_paging_by_rank(self):
+        for i in range(30):
+            self.create_listing(title=f"Lamp {i}", description="lamp " * (i % 4))
+        seen, url = [], reverse("search_api") + "?q=lamp"
+        while url:
+            page = self.client.get(url).json()
+            seen += page["results"]
+            url = page["next"]
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len({result["id"] for result in seen}), 30)
+        ranks = [result["rank"] for result in seen]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+    def test_index_is_reinstalled_after_table_rebuilds(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("Only SQLite keeps the index up to date with triggers")
+        with connection.cursor() as cursor:
+            for name in search.SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER {name}")
+        self.create_listing(title="Desktop")
+        self.assertEqual(self.titles(q="desktop"), [])
+        self.assertTrue(search.install_sqlite_index(connection))
+        self.assertFalse(search.install_sqlite_index(connection))
+        self.assertEqual(self.titles(q="desktop"), ["Desktop"])
+        self.listing.title = "Notebook"
+        self.listing.save()
+        self.assertEqual(self.titles(q="notebook"), ["Notebook"])
+
+    def test_search_page(self):
+        response = self.client.get(reverse("search"), {"q": "laptop"})
+        self.assertContains(response, reverse("listing", args=[self.listing.id]))
+        self.assertEqual(self.client.get(reverse("search")).status_code, 200)
+
+
+class ApiTests(AuctionTestCase):
+    def get(self, name, *args, query=""):
+        return self.client.get(reverse(name, args=args) + query)
+
+    def test_sparse_fieldsets(self):
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        response = self.get("api_listings", query="?fields=id,owner,photo")
+        self.assertEqual(response.json()["data"], [{
+            "id": self.listing.id,
+            "owner": "owner",
+            "photo": self.listing.photo.url,
+        }])
+        data = self.get("api_listing", self.listing.id, query="?fields=title,current_price").json()["data"]
+        self.assertEqual(data["title"], "Laptop")
+        self.assertEqual(data["current_price"], 15)
+        self.assertNotIn("description", data)
+
+        response = self.get("api_listings", query="?fields=id,password")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", response.json()["error"])
+
+    def test_filters(self):
+        closed = self.create_listing(title="Phone", category=None)
+        Listing.objects.filter(pk=closed.pk).update(active=False)
+        titles = lambda query: [row["title"] for row in self.get("api_listings", query=query).json()["data"]]
+        self.assertEqual(titles(""), ["Laptop"])
+        self.assertEqual(titles("?status=closed"), ["Phone"])
+        self.assertEqual(titles("?status=all&category=Tech"), ["Laptop"])
+        self.assertEqual(self.get("api_listings", query="?status=sold").status_code, 400)
+
+    def test_bids_are_paged_highest_first(self):
+        for value in range(11, 11 + api.API_PAGE_SIZE + 5):
+            Bid.objects.create(value=value, user=self.alice, listing=self.listing)
+        self.client.force_login(self.owner)
+        first = self.get("api_listing_bids", self.listing.id).json()
+        self.assertEqual(len(first["data"]), api.API_PAGE_SIZE)
+        self.assertEqual(first["data"][0]["value"], 10 + api.API_PAGE_SIZE + 5)
+        self.assertEqual(set(first["data"][0]), {"id", "value", "user", "created"})
+        second = self.client.get(first["next"]).json()
+        self.assertEqual([row["value"] for row in second["data"]], [15, 14, 13, 12, 11])
+        self.assertIsNone(second["next"])
+        self.assertIsNotNone(second["previous"])
+
+    def test_bids_are_shown_to_the_owner_only(self):
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        self.assertEqual(self.get("api_listing_bids", self.listing.id).status_code, 403)
+        self.client.force_login(self.alice)
+        self.assertEqual(self.get("api_listing_bids", self.listing.id).status_code, 403)
+        self.assertEqual(self.get("api_listings", query="?fields=leader").status_code, 400)
+
+    def test_missing_listing_is_not_found(self):
+        for name in ("api_listing", "api_listing_bids", "api_listing_comments"):
+            with self.subTest(name=name):
+                response = self.get(name, 0)
+                self.assertEqual(response.status_code, 404)
+                self.assertIn("error", response.json())
+        self.assertEqual(self.get("api_listing_comments", self.listing.id).json()["data"], [])
+
+    def test_is_read_only(self):
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.post(reverse("api_listings")).status_code, 405)
+
+    def test_categories(self):
+        Category.objects.create(name="Books")
+        self.assertEqual(self.get("api_categories", query="?fields=name").json()["data"],
+                         [{"name": "Books"}, {"name": "Tech"}])
+
+
+class CategoryCatalogTests(AuctionTestCase):
+    def assertCounts(self, **expected):
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+        self.assertEqual(dict(Category.objects.values_list("name", "active_listings")), expected)
+
+    def test_counts_follow_listings(self):
+        books = Category.objects.create(name="Books")
+        self.assertCounts(Tech=1, Books=0)
+        second = self.create_listing()
+        self.create_listing(category=None)
+        self.assertCounts(Tech=2, Books=0)
+
+        second.category = books
+        second.save()
+        self.assertCounts(Tech=1, Books=1)
+        self.listing.active = False
+        self.listing.save()
+        self.assertCounts(Tech=0, Books=1)
+        # Saving a stale copy of a closed listing doesn't count it twice.
+        stale = Listing.objects.get(pk=second.pk)
+        second.active = False
+        second.save()
+        stale.active = False
+        stale.save()
+        self.assertCounts(Tech=0, Books=0)
+
+        third = self.create_listing(category=books)
+        third.delete()
+        # Nor does deleting a stale copy of a listing closed meanwhile.
+        stale = self.create_listing(category=books, ends_at=timezone.now() - timezone.timedelta(hours=1))
+        closing.close_expired()
+        stale.delete()
+        self.create_listing(category=books, ends_at=timezone.now() + timezone.timedelta(hours=1))
+        self.assertCounts(Tech=0, Books=1)
+        closing.close_expired(timezone.now() + timezone.timedelta(days=1))
+        self.assertCounts(Tech=0, Books=0)
+
+    def test_pages_read_categories_from_memory(self):
+        self.client.get(reverse("categories"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("categories"))
+        self.assertContains(response, '<span class="category-count">1</span>', html=True)
+        # Only the page's stamp and its listings.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(reverse("category", args=["Tech"])).status_code, 200)
+
+    def test_changes_reload_the_catalog(self):
+        self.client.get(reverse("categories"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_listing()
+        self.assertContains(self.client.get(reverse("categories")),
+                            '<span class="category-count">2</span>', html=True)
+        # Made by another process: unknown names are looked up before a 404.
+        Category.objects.bulk_create([Category(name="Books")])
+        self.assertContains(self.client.get(reverse("category", args=["Books"])), "Books")
+        response = self.client.get(reverse("category", args=["Games"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "auctions/404.html")
+
+    def test_changes_touch_only_the_affected_feeds(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            books = Category.objects.create(name="Books")
+        keys = (stamps.index_key(), stamps.category_key(self.category.pk), stamps.category_key(books.pk))
+        before = [stamps.load(key).version for key in keys]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_listing()
+        after = [stamps.load(key).version for key in keys]
+        self.assertEqual([new > old for old, new in zip(before, after)], [True, True, False])
+
+
+class ListingCardTests(AuctionTestCase):
+    def test_cards_carry_everything_they_show(self):
+        Comment.objects.create(user=self.alice, listing=self.listing, text="Nice!")
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        Listing.objects.filter(pk=self.listing.pk).update(description="word " * 400)
+        with self.assertNumQueries(1):
+            card = Listing.objects.cards(comment_count=True).get(pk=self.listing.pk)
+            self.assertEqual((card.comment_count, card.bid_count, card.current_price), (1, 1, 15))
+            self.assertEqual((card.owner.username, card.category.name), ("owner", "Tech"))
+            self.assertEqual(len(card.card_description), models.CARD_DESCRIPTION_LENGTH + 1)
+        self.assertIn("description", card.get_deferred_fields())
+
+    def test_feeds_render_cards_without_further_queries(self):
+        for i in range(10):
+            listing = self.create_listing(title=f"Listing {i}")
+            Comment.objects.create(user=self.alice, listing=listing, text="Nice!")
+        self.client.force_login(self.owner)
+        for name, count in (("index", 6), ("my_listings", 3)):
+            with self.subTest(page=name), self.assertNumQueries(count) as queries:
+                self.client.get(reverse(name))
+            self.assertFalse([query for query in queries if "description" in query["sql"]
+                              and "SUBSTR" not in query["sql"].upper()])
+            # Only my listings show comment counts.
+            self.assertEqual(any("auctions_comment" in query["sql"] for query in queries),
+                             name == "my_listings")
+        self.assertContains(self.client.get(reverse("my_listings")), "See listing (1 comment)")
+
+
+class ListingPageSliceTests(AuctionTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        for i in range(views.LISTING_SLICE + 5):
+            Comment.objects.create(user=self.alice, listing=self.listing, text=f"Comment {i}",
+                                   datetime=now + timezone.timedelta(minutes=i))
+            Bid.objects.create(value=20 + i, user=self.alice, listing=self.listing)
+
+    def test_page_shows_newest_slice(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse("listing", args=[self.listing.id]))
+        self.assertEqual(len(response.context["comments"]), views.LISTING_SLICE)
+        self.assertContains(response, f"Comment {views.LISTING_SLICE + 4}")
+        self.assertNotContains(response, "Comment 4<")
+        self.assertEqual(len(response.context["bids"]), views.LISTING_SLICE)
+
+        older = self.client.get(response.context["comments"].next_url)
+        self.assertTemplateUsed(older, "auctions/comments.html")
+        self.assertEqual([comment.text for comment in older.context["comments"]],
+                         [f"Comment {i}" for i in range(4, -1, -1)])
+        self.assertNotContains(older, "load-more")
+        older = self.client.get(response.context["bids"].next_url)
+        self.assertEqual([bid.value for bid in older.context["bids"]], [24, 23, 22, 21, 20])
+
+    def test_bid_history_is_for_the_owner(self):
+        self.client.force_login(self.alice)
+        self.assertIsNone(self.client.get(reverse("listing", args=[self.listing.id])).context["bids"])
+        self.assertEqual(self.client.get(reverse("listing_bids", args=[self.listing.id])).status_code, 403)
+
+    def test_posting_a_comment_returns_its_fragment(self):
+        url = reverse("listing_comments", args=[self.listing.id])
+        self.assertEqual(self.client.post(url, {"text": "Hi"}).status_code, 403)
+        self.client.force_login(self.bob)
+        response = self.client.post(url, {"text": "Is it still available?"})
+        self.assertEqual(response.status_code, 201)
+        self.assertContains(response, "Is it still available?", status_code=201)
+        self.assertContains(response, f'data-id="{Comment.objects.latest("pk").pk}"', status_code=201)
+        self.assertNotContains(response, "Comment 1", status_code=201)
+        self.assertEqual(self.client.post(url, {"text": ""}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("listing_comments", args=[0])).status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+class ReplicaRoutingTests(SimpleTestCase):
+    def route(self, request, write=False):
+        @replicas.replica_reads
+        def view(request):
+            if write:
+                router.db_for_write(Bid)
+            return router.db_for_read(Listing)
+
+        router = replicas.ReplicaRouter()
+        token = replicas._state.set(replicas.RequestState())
+        try:
+            return view(request), router.db_for_read(Listing)
+        finally:
+            replicas._state.reset(token)
+
+    def test_marked_views_read_from_one_replica(self):
+        self.assertIn(self.route(RequestFactory().get("/"))[0], {"replica1", "replica2"})
+        # Only for the duration of the view.
+        self.assertEqual(self.route(RequestFactory().get("/"))[1], "default")
+
+    def test_writes_and_their_authors_stay_on_the_primary(self):
+        factory = RequestFactory()
+        self.assertEqual(self.route(factory.post("/"))[0], "default")
+        self.assertEqual(self.route(factory.get("/"), write=True)[0], "default")
+        factory.cookies[replicas.STICKY_COOKIE] = str(time.time() + 5)
+        self.assertEqual(self.route(factory.get("/"))[0], "default")
+        factory.cookies[replicas.STICKY_COOKIE] = str(time.time() - 5)
+        self.assertIn(self.route(factory.get("/"))[0], {"replica1", "replica2"})
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_the_primary(self):
+        self.assertEqual(self.route(RequestFactory().get("/"))[0], "default")
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class StickyPrimaryTests(AuctionTestCase):
+    def test_writers_are_pinned_to_the_primary(self):
+        self.client.force_login(self.alice)
+        self.assertNotIn(replicas.STICKY_COOKIE, self.client.get(reverse("index")).cookies)
+        response = self.client.post(reverse("listing", args=[self.listing.id]), {"value": 15, "place_bid": ""})
+        self.assertEqual(response.status_code, 302)
+        until = float(response.cookies[replicas.STICKY_COOKIE].value)
+        self.assertAlmostEqual(until, time.time() + settings.REPLICA_STICKY_SECONDS, delta=2)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaViewTests(AuctionFixtures, TransactionTestCase):
+    def routes(self, url):
+        # The test database has no replica: note where each read would go,
+        # and run it on the primary. Outside a test transaction, as reads in
+        # a transaction always stay on the primary.
+        routes = {}
+        route = replicas.ReplicaRouter.db_for_read
+
+        def db_for_read(router, model, **hints):
+            routes.setdefault(model, set()).add(route(router, model, **hints))
+            return "default"
+
+        with mock.patch.object(replicas.ReplicaRouter, "db_for_read", db_for_read):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return routes
+
+    def test_validators_come_from_the_replica_rendering_the_page(self):
+        routes = self.routes(reverse("index"))
+        self.assertEqual(routes[models.PageStamp], {"replica1"})
+        self.assertEqual(routes[Listing], {"replica1"})
+
+    def test_watchlist_reads_from_the_replica(self):
+        self.alice.watch([self.listing.id])
+        self.client.force_login(self.alice)
+        self.assertEqual(self.routes(reverse("watchlist"))[Listing], {"replica1"})
+
+
+class ConcurrentSqliteTests(SimpleTestCase):
+    def connect(self, path, **options):
+        wrapper = sqlite_backend.DatabaseWrapper({
+            **connection.settings_dict, "NAME": path, "OPTIONS": options, "TEST": {},
+        }, alias="concurrent")
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_pragmas_and_immediate_transactions(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f"{directory}/db.sqlite3"
+        first = self.connect(path, pragmas={"busy_timeout": 50})
+        with first.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 50)
+            cursor.execute("CREATE TABLE t (x)")
+
+        second = self.connect(path, pragmas={"busy_timeout": 50})
+        # As atomic() does.
+        first.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        try:
+            # The write lock is taken at BEGIN, before anything is written.
+            first.cursor().execute("SELECT * FROM t")
+            with self.assertRaisesMessage(OperationalError, "locked"):
+                second.cursor().execute("INSERT INTO t VALUES (1)")
+        finally:
+            first.rollback()
+            first.set_autocommit(True)
+
+
+@override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+class ServerTimingTests(AuctionTestCase):
+    def setUp(self):
+        super().setUp()
+        timing.reset()
+        self.addCleanup(timing.reset)
+
+    def test_header_and_route_stats(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("listing", args=[self.listing.id]))
+        metrics = {part.split(";")[0]: part for part in response["Server-Timing"].split(", ")}
+        self.assertEqual(set(metrics), {"db", "tpl", "app", "total"})
+        self.assertIn(f'desc="{len(queries)} queries"', metrics["db"])
+
+        stats = timing.stats()["listing"]
+        self.assertEqual((stats["count"], stats["mean_queries"]), (1, len(queries)))
+        self.assertGreater(stats["mean_templates"], 0)
+        self.assertLessEqual(stats["p50"], stats["p95"])
+
+    @override_settings(SERVER_TIMING_WINDOW=3)
+    def test_windows_are_bounded(self):
+        for _ in range(5):
+            self.client.get(reverse("categories"))
+        self.assertEqual(timing.stats()["categories"]["count"], 3)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_off_when_not_sampled(self):
+        self.assertNotIn("Server-Timing", self.client.get(reverse("index")))
+        self.assertEqual(timing.stats(), {})
+
+    def test_stats_are_staff_only(self):
+        self.client.get(reverse("index"))
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(reverse("timing_stats")).status_code, 403)
+        User.objects.filter(pk=self.alice.pk).update(is_staff=True)
+        response = self.client.get(reverse("timing_stats"))
+        self.assertEqual(response.json()["routes"]["index"]["count"], 1)
+
+
+class MyBidsTests(AuctionTestCase):
+    def test_one_row_per_listing(self):
+        other = self.create_listing(title="Phone")
+        Bid.objects.create(value=15, user=self.alice, listing=self.listing)
+        Bid.objects.create(value=20, user=self.alice, listing=self.listing)
+        Bid.objects.create(value=12, user=self.alice, listing=other)
+        Bid.objects.create(value=30, user=self.bob, listing=other)
+        Listing.objects.filter(pk=other.pk).update(active=False)
+
+        rows = {listing.title: listing for listing in Listing.objects.bid_on_by(self.alice)}
+        self.assertEqual(set(rows), {"Laptop", "Phone"})
+        self.assertEqual((rows["Laptop"].my_bid, rows["Laptop"].current_price, rows["Laptop"].leading), (20, 20, True))
+        self.assertEqual((rows["Phone"].my_bid, rows["Phone"].current_price, rows["Phone"].leading), (12, 30, False))
+
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse("my_bids"))
+        self.assertContains(response, "Your bid is the highest bid so far")
+        self.assertContains(response, "Sold for $30")
+
+    def test_paged_by_latest_bid(self):
+        now = timezone.now()
+        listings = [self.create_listing(title=f"Listing {i}") for i in range(30)]
+        for i, listing in enumerate(listings):
+            Bid.objects.create(value=20, user=self.alice, listing=listing,
+                               datetime=now - timezone.timedelta(minutes=i))
+        request = RequestFactory().get("/")
+        first = paginate(request, Listing.objects.bid_on_by(self.alice), field="last_bid_at")
+        self.assertEqual([listing.title for listing in first], [f"Listing {i}" for i in range(24)])
+        second = paginate(RequestFactory().get("/", {"cursor": first.next_cursor}),
+                          Listing.objects.bid_on_by(self.alice), field="last_bid_at")
+        self.assertEqual([listing.title for listing in second], [f"Listing {i}" for i in range(24, 30)])
+
+
+class ConditionalGetTests(AuctionTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            stamps.touch_listing(self.listing.id, self.category.id)
+
+    def revalidate(self, url, response, **headers):
+        headers.setdefault("HTTP_IF_NONE_MATCH", response["ETag"])
+        return self.client.get(url, **headers)
+
+    def test_unchanged_listing_is_not_modified_with_one_query(self):
+        url = reverse("listing", args=[self.listing.id])
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+        # The version has no time to offer.
+        self.assertNotIn("Last-Modified", response)
+
+    def test_changes_advance_the_listing_stamp(self):
+        url = reverse("listing", args=[self.listing.id])
+        changes = [
+            lambda: Bid.objects.create(value=15, user=self.alice, listing=self.listing),
+            lambda: Comment.objects.create(user=self.alice, listing=self.listing, text="Nice!"),
+            lambda: Comment.objects.get().delete(),
+            lambda: Comment.objects.create(user=self.alice, listing=self.listing, text="Nice!"),
+            lambda: Comment.objects.all().delete(),
+            lambda: closing.close_expired_batch(timezone.now() + timezone.timedelta(days=1)),
+        ]
+        Listing.objects.filter(pk=self.listing.pk).update(ends_at=timezone.now() + timezone.timedelta(hours=1))
+        response = self.client.get(url)
+        for change in changes:
+            change()
+            response = self.revalidate(url, response)
+            self.assertEqual(response.status_code, 200)
+
+    def test_stamps_change_with_the_data_or_not_at_all(self):
+        url = reverse("listing", args=[self.listing.id])
+        responses = {url: self.client.get(url) for url in (url, reverse("index"))}
+        with mock.patch("auctions.stamps.bump", side_effect=OperationalError("database is locked")), \
+                self.assertRaises(OperationalError):
+            bidding.place_bid(self.listing, self.alice, 50)
+        self.assertEqual(Listing.objects.get(pk=self.listing.pk).current_price, 10)
+        bidding.place_bid(self.listing, self.alice, 50)
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_bulk_changes_advance_the_feeds(self):
+        url = reverse("index")
+        response = self.client.get(url)
+        call_command("repair_bid_summaries", stdout=StringIO())
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_deleting_a_listing_touches_its_stamps_once(self):
+        for i in range(20):
+            Bid.objects.create(value=20 + i, user=self.alice, listing=self.listing)
+            Comment.objects.create(user=self.alice, listing=self.listing, text="Nice!")
+        with CaptureQueriesContext(connection) as queries:
+            Listing.objects.get(pk=self.listing.pk).delete()
+        self.assertLess(len(queries), 20)
+        # One bump for the category counter, one for the listing.
+        self.assertEqual(len([query for query in queries if "auctions_pagestamp" in query["sql"]]), 4)
+
+    def test_stamps_are_shared_by_every_process(self):
+        # Nothing is held in process memory: another worker, or this one after
+        # losing its caches, gives the same answer.
+        url = reverse("index")
+        response = self.client.get(url)
+        for cache in caches.all():
+            cache.clear()
+        catalog.invalidate()
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        stamps.touch_listing(self.listing.id)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_passing_the_scheduled_end_changes_the_listing(self):
+        url = reverse("listing", args=[self.listing.id])
+        Listing.objects.filter(pk=self.listing.pk).update(ends_at=timezone.now() + timezone.timedelta(hours=1))
+        response = self.client.get(url)
+        later = timezone.now() + timezone.timedelta(hours=2)
+        with mock.patch("auctions.stamps.timezone.now", return_value=later):
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_feeds_follow_their_listings(self):
+        index, category = reverse("index"), reverse("category", args=[self.category.name])
+        responses = {url: self.client.get(url) for url in (index, category)}
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Category.objects.create(name="Books")
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+        responses = {url: self.client.get(url) for url in (index, category)}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other_listing = self.create_listing(category=other)
+        # Every feed lists the categories with their counts.
+        for url, response in responses.items():
+            self.assertEqual(self.revalidate(url, response).status_code, 200)
+        responses = {url: self.client.get(url) for url in (index, category)}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Bid.objects.create(value=15, user=self.alice, listing=other_listing)
+        self.assertEqual(self.revalidate(index, responses[index]).status_code, 200)
+        self.assertEqual(self.revalidate(category, responses[category]).status_code, 304)
+
+    def test_stamps_are_per_viewer(self):
+        url = reverse("listing", args=[self.listing.id])
+        anonymous = self.client.get(url)
+        self.client.force_login(self.alice)
+        # The first page sets the CSRF cookie its forms need, which changes the stamp.
+        response = self.revalidate(url, self.client.get(url))
+        self.assertNotEqual(response["ETag"], anonymous["ETag"])
+        self.assertNotIn("Last-Modified", response)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        self.alice.watch([self.listing.id])
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        Notification.objects.create(user=self.alice, text="News")
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class UnreadCounterTests(AuctionTestCase):
+    def notify(self, user, **kwargs):
+        return Notification.objects.create(user=user, text="Hello", url="/", **kwargs)
+
+    def test_counter_follows_notifications(self):
+        first = self.notify(self.alice)
+        self.notify(self.alice)
+        self.notify(self.alice, seen=True)
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.unread_count, 2)
+        first.mark_seen()
+        first.mark_seen()
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.unread_count, 1)
+
+    def test_counter_follows_deletes(self):
+        self.notify(self.alice)
+        self.notify(self.alice)
+        self.notify(self.alice, seen=True)
+        Notification.objects.filter(user=self.alice).delete()
+        self.assertEqual(User.objects.get(pk=self.alice.pk).unread_count, 0)
+
+    def test_mark_all_read_repairs_the_counter(self):
+        User.objects.filter(pk=self.alice.pk).update(unread_count=3)
+        self.client.force_login(self.alice)
+        self.client.post(reverse("mark_all_read"))
+        self.assertEqual(User.objects.get(pk=self.alice.pk).unread_count, 0)
+
+    def test_saving_stale_user_keeps_counter(self):
+        stale = User.objects.get(pk=self.alice.pk)
+        self.notify(self.alice)
+        stale.email = "new@example.com"
+        stale.save()
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.unread_count, 1)
+
+    def test_layout_shows_counter_without_counting(self):
+        notification = self.notify(self.alice)
+        self.client.force_login(self.alice)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("categories"))
+        self.assertFalse([q for q in queries if "auctions_notification" in q["sql"]])
+        self.assertEqual(response.context["unread"], 1)
+        self.assertContains(response, "Auctions (1)")
+        self.client.get(reverse("notification", args=[notification.id]))
+        response = self.client.get(reverse("categories"))
+        self.assertEqual(response.context["unread"], 0)
+
+    def test_repair_command(self):
+        self.notify(self.alice)
+        User.objects.update(unread_count=5)
+        with self.assertRaises(CommandError):
+            call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+        call_command("repair_unread_counts", stdout=StringIO())
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+
+
+class NotificationFanOutTests(AuctionTestCase):
+    def run_jobs(self):
+        call_command("run_jobs", "--once", stdout=StringIO())
+
+    def unread(self, user, kind):
+        return list(user.notifications.filter(kind=kind, seen=False).values_list("text", flat=True))
+
+    def test_outbid_bidders_get_one_unread_notification_per_listing(self):
+        carol = User.objects.create_user("carol", "carol@example.com", "password")
+        bidding.place_bid(self.listing, self.alice, 20)
+        bidding.place_bid(self.listing, self.bob, 30)
+        self.run_jobs()
+        self.assertEqual(len(self.unread(self.alice, Notification.OUTBID)), 1)
+        bidding.place_bid(self.listing, carol, 40)
+        self.run_jobs()
+        self.assertIn("$40", *self.unread(self.bob, Notification.OUTBID))
+        # Only the previous leader is told; alice's notification is left alone.
+        self.assertIn("$30", *self.unread(self.alice, Notification.OUTBID))
+        self.alice.notifications.get().mark_seen()
+        bidding.place_bid(self.listing, self.alice, 50)
+        self.run_jobs()
+        self.assertEqual(self.alice.notifications.count(), 1)
+        self.assertEqual(len(self.unread(carol, Notification.OUTBID)), 1)
+        self.assertIn("$40", *self.unread(self.bob, Notification.OUTBID))
+        self.assertEqual(User.objects.get(pk=self.bob.pk).unread_count, 1)
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+
+    def test_closing_notifies_winner_and_watchers(self):
+        watchers = [User.objects.create_user(f"watcher{i}", "w@example.com", "password") for i in range(5)]
+        for user in watchers + [self.owner, self.alice]:
+            user.watchlist.add(self.listing)
+        bidding.place_bid(self.listing, self.alice, 20)
+        self.client.force_login(self.owner)
+        self.client.get(reverse("deactivate", args=[self.listing.id]))
+        self.run_jobs()
+        self.assertEqual(len(self.unread(self.alice, Notification.WON)), 1)
+        self.assertEqual(self.unread(self.alice, Notification.CLOSED), [])
+        self.assertFalse(self.owner.notifications.exists())
+        for user in watchers:
+            self.assertEqual(len(self.unread(user, Notification.CLOSED)), 1)
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+
+    def test_notifications_outlive_their_listing(self):
+        self.bob.watchlist.add(self.listing)
+        Listing.objects.filter(pk=self.listing.pk).update(ends_at=timezone.now())
+        closing.close_expired()
+        self.run_jobs()
+        self.listing.delete()
+        self.assertEqual(len(self.unread(self.bob, Notification.CLOSED)), 1)
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+
+    def test_scheduler_notifies_watchers(self):
+        self.bob.watchlist.add(self.listing)
+        Listing.objects.filter(pk=self.listing.pk).update(ends_at=timezone.now())
+        closing.close_expired()
+        self.run_jobs()
+        self.assertEqual(len(self.unread(self.bob, Notification.CLOSED)), 1)
+
+    def test_fan_out_cost_does_not_grow_with_audience(self):
+        users = [User(username=f"fan{i}", email="fan@example.com") for i in range(400)]
+        User.objects.bulk_create(users)
+        ids = list(User.objects.filter(username__startswith="fan").values_list("pk", flat=True))
+        notify.fan_out(self.listing.id, Notification.CLOSED, ids[:3], "Closed")
+        with CaptureQueriesContext(connection) as queries:
+            notify.fan_out(self.listing.id, Notification.CLOSED, ids, "Closed again")
+        # A savepoint, the refresh, the insert (in a few chunks on SQLite) and the counters.
+        self.assertLessEqual(len(queries), 8)
+        self.assertEqual(Notification.objects.filter(kind=Notification.CLOSED).count(), 400)
+        self.assertEqual(Notification.objects.filter(text="Closed again").count(), 400)
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+
+    def test_mark_all_read(self):
+        for i in range(3):
+            Notification.objects.create(user=self.alice, text=f"News {i}", url="/")
+        Notification.objects.create(user=self.bob, text="News", url="/")
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(reverse("mark_all_read")).status_code, 405)
+        response = self.client.post(reverse("mark_all_read"))
+        self.assertRedirects(response, reverse("notifications"))
+        self.assertFalse(self.alice.notifications.filter(seen=False).exists())
+        self.assertEqual(User.objects.get(pk=self.alice.pk).unread_count, 0)
+        self.assertEqual(User.objects.get(pk=self.bob.pk).unread_count, 1)
+
+
+class WatchlistTests(AuctionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = self.create_listing(title="Sofa")
+        self.client.force_login(self.alice)
+
+    def api(self, body):
+        return self.client.post(reverse("watchlist_api"), json.dumps(body), content_type="application/json")
+
+    def test_listing_page_checks_one_listing(self):
+        self.client.get(reverse("watch", args=[self.listing.id]))
+        self.assertContains(self.client.get(reverse("listing", args=[self.listing.id])), "Remove from watchlist")
+        self.assertContains(self.client.get(reverse("listing", args=[self.other.id])), "Add to watchlist")
+        self.client.get(reverse("unwatch", args=[self.listing.id]))
+        self.assertContains(self.client.get(reverse("listing", args=[self.listing.id])), "Add to watchlist")
+
+    def test_feeds_reuse_cached_watched_ids(self):
+        self.alice.watch([self.listing.id])
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, reverse("unwatch", args=[self.listing.id]))
+        self.assertContains(response, reverse("watch", args=[self.other.id]))
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(reverse("search"), {"q": "laptop"})
+        self.client.get(reverse("watch", args=[self.other.id]) + "?next=/")
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, reverse("unwatch", args=[self.other.id]))
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get(reverse("search"), {"q": "laptop"})
+        self.assertEqual(len(cached), len(first))
+        self.assertFalse(any("auctions_user_watchlist" in query["sql"] for query in cached))
+
+    def test_watch_views(self):
+        response = self.client.get(reverse("watch", args=[self.listing.id]), {"next": "https://evil.example.com/"})
+        self.assertRedirects(response, reverse("listing", args=[self.listing.id]), fetch_redirect_response=False)
+        response = self.client.get(reverse("watch", args=[self.listing.id]), {"next": "/watchlist"})
+        self.assertRedirects(response, "/watchlist", fetch_redirect_response=False)
+        self.assertEqual(list(self.alice.watchlist.all()), [self.listing])
+        response = self.client.get(reverse("watch", args=[self.listing.id + 100]))
+        self.assertTemplateUsed(response, "auctions/404.html")
+
+    def test_batch_api(self):
+        self.alice.watch([self.other.id])
+        response = self.api({"watch": [self.listing.id, self.listing.id + 100], "unwatch": [self.other.id]})
+        self.assertEqual(response.json(), {"watched": [self.listing.id], "unwatched": [self.other.id]})
+        self.assertEqual(set(User.objects.get(pk=self.alice.pk).watched_ids()), {self.listing.id})
+        self.assertEqual(self.api({"watch": [self.listing.id], "unwatch": [self.listing.id]}).status_code, 400)
+        self.assertEqual(self.api({"watch": ["x"]}).status_code, 400)
+        self.assertEqual(self.api(["nope"]).status_code, 400)
+        self.assertEqual(self.client.get(reverse("watchlist_api")).status_code, 405)
+
+    def test_related_manager_changes_invalidate_cache(self):
+        self.assertEqual(self.alice.watched_ids(), frozenset())
+        self.alice.watchlist.add(self.listing)
+        self.assertEqual(self.alice.watched_ids(), {self.listing.id})
+        self.bob.watch([self.listing.id])
+        self.assertEqual(self.bob.watched_ids(), {self.listing.id})
+        self.listing.users_watching.clear()
+        for user in (self.alice, self.bob):
+            self.assertEqual(User.objects.get(pk=user.pk).watched_ids(), frozenset())
+
+
+class IndexUsageTests(AuctionTestCase):
+    def assertUsesIndex(self, queryset):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Tiny test tables are always cheaper to scan; take that option away.
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        if connection.vendor == "postgresql":
+            self.assertNotIn("Seq Scan", plan, plan)
+            self.assertNotIn("Sort", plan, plan)
+        elif connection.vendor == "sqlite":
+            self.assertNotRegex(plan, r"(?m)SCAN \w+$", plan)
+            self.assertNotIn("TEMP B-TREE", plan, plan)
+
+    def test_hot_queries_use_indexes(self):
+        self.assertUsesIndex(Listing.objects.filter(active=True).order_by("-datetime", "-pk")[:25])
+        self.assertUsesIndex(Listing.objects.filter(active=True).filter(
+            Q(datetime__lt=self.listing.datetime) | Q(datetime=self.listing.datetime, pk__lt=self.listing.pk)
+        ).order_by("-datetime", "-pk")[:25])
+        self.assertUsesIndex(self.category.listings.filter(active=True).order_by("-datetime", "-pk")[:25])
+        self.assertUsesIndex(self.owner.listings.order_by("-datetime", "-pk")[:25])
+        self.assertUsesIndex(self.listing.bids.order_by("-value")[:1])
+        self.assertUsesIndex(self.alice.bids.order_by("-datetime", "-pk")[:25])
+        self.assertUsesIndex(self.alice.notifications.filter(seen=False))
+        self.assertUsesIndex(self.alice.notifications.order_by("-datetime", "-pk")[:25])
+        self.assertUsesIndex(Comment.objects.filter(listing=self.listing).order_by("-datetime"))
+        self.assertUsesIndex(Listing.objects.expired().order_by("ends_at", "pk")[:500])
+
+
+class ListingCardCacheTests(AuctionTestCase):
+    def test_cards_are_cached_until_listing_changes(self):
+        self.assertContains(self.client.get(reverse("index")), "owner's")
+        # Not a listing change, but the owner and category are part of the key.
+        User.objects.filter(pk=self.owner.pk).update(username="renamed")
+        Category.objects.filter(pk=self.category.pk).update(name="Gadgets")
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "renamed's")
+        self.assertContains(response, "in Gadgets")
+        self.assertContains(response, "$10")
+
+        Bid.objects.create(value=25, user=self.alice, listing=self.listing)
+        self.assertContains(self.client.get(reverse("index")), "$25")
+
+        listing = Listing.objects.get(pk=self.listing.pk)
+        listing.title = "Gaming laptop"
+        listing.save()
+        self.assertContains(self.client.get(reverse("index")), "Gaming laptop")
+
+    def test_every_change_bumps_version(self):
+        version = self.listing.version
+        self.listing.save()
+        Bid.objects.create(value=25, user=self.alice, listing=self.listing)
+        Listing.objects.filter(pk=self.listing.pk).refresh_bid_summary()
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.version, version + 3)
+
+
+class QueryBudgetTests(AuctionTestCase):
+    """Every page must run a fixed number of queries, however much data there is."""
+
+    # Signed-in worst case, including the session and user lookups, the
+    # watched listing ids when they are not cached yet, and version stamps.
+    BUDGETS = {
+        "index": 6,
+        "categories": 3,
+        "category": 7,
+        "search": 5,
+        "search_api": 3,
+        "listing": 7,
+        "listing_comments": 5,
+        "listing_bids": 5,
+        "login": 2,
+        "register": 2,
+        "new_listing": 3,
+        "watchlist": 3,
+        "my_listings": 3,
+        "my_bids": 3,
+        "timing_stats": 2,
+        "notifications": 3,
+        "notification": 8,
+        "mark_all_read": 3,
+        "watch": 5,
+        "unwatch": 5,
+        "watchlist_api": 3,
+        "deactivate": 18,
+        "logout": 4,
+        "api_listings": 3,
+        "api_listing": 3,
+        "api_listing_bids": 4,
+        "api_listing_comments": 3,
+        "api_categories": 3,
+    }
+
+    def seed(self, listings):
+        users = [self.alice, self.bob] + [
+            User.objects.create_user(f"user{i}-{User.objects.count()}", "user@example.com", "password")
+            for i in range(3)
+        ]
+        for i in range(listings):
+            listing = self.create_listing(title=f"Listing {i}", datetime=timezone.now())
+            for value, user in enumerate(users, start=listing.starting_price):
+                Bid.objects.create(value=value, user=user, listing=listing)
+            if i % 5 == 0:
+                Listing.objects.filter(pk=listing.pk).update(active=False)
+            for user in users:
+                Comment.objects.create(user=user, listing=listing, text="Nice!")
+            self.alice.watchlist.add(listing)
+            Notification.objects.create(user=self.alice, text=f"News about {listing}",
+                                        url=reverse("listing", args=[listing.id]))
+
+    def pages(self):
+        listing = self.listing
+        notification = self.alice.notifications.order_by("-pk").first()
+        closable = self.owner.listings.filter(active=True).order_by("-pk").first()
+        return [
+            ("index", reverse("index")),
+            ("categories", reverse("categories")),
+            ("category", reverse("category", args=[self.category.name])),
+            ("search", reverse("search") + "?q=listing"),
+            ("search_api", reverse("search_api") + "?q=listing"),
+            ("listing", reverse("listing", args=[listing.id])),
+            ("listing_comments", reverse("listing_comments", args=[listing.id])),
+            ("listing_bids", reverse("listing_bids", args=[listing.id])),
+            ("login", reverse("login")),
+            ("register", reverse("register")),
+            ("new_listing", reverse("new_listing")),
+            ("watchlist", reverse("watchlist")),
+            ("watchlist_api", reverse("watchlist_api")),
+            ("my_listings", reverse("my_listings")),
+            ("my_bids", reverse("my_bids")),
+            ("timing_stats", reverse("timing_stats")),
+            ("notifications", reverse("notifications")),
+            ("notification", reverse("notification", args=[notification.id])),
+            ("mark_all_read", reverse("mark_all_read")),
+            ("watch", reverse("watch", args=[listing.id])),
+            ("unwatch", reverse("unwatch", args=[listing.id])),
+            ("deactivate", reverse("deactivate", args=[closable.id])),
+            ("logout", reverse("logout")),
+            ("api_listings", reverse("api_listings") + "?fields=id,title,owner,photo"),
+            ("api_listing", reverse("api_listing", args=[listing.id])),
+            ("api_listing_bids", reverse("api_listing_bids", args=[listing.id])),
+            ("api_listing_comments", reverse("api_listing_comments", args=[listing.id])),
+            ("api_categories", reverse("api_categories")),
+        ]
+
+    def measure(self, user):
+        counts = {}
+        for name, url in self.pages():
+            for cache in caches.all():
+                cache.clear()
+            catalog.invalidate()
+            if user:
+                self.client.force_login(user)
+            else:
+                self.client.logout()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            counts[name] = len(queries)
+        return counts
+
+    def test_budgets(self):
+        self.seed(5)
+        small = {user: self.measure(user) for user in (None, self.alice, self.owner)}
+        self.seed(40)
+        large = {user: self.measure(user) for user in (None, self.alice, self.owner)}
+        for user in small:
+            for name, budget in self.BUDGETS.items():
+                with self.subTest(user=user, page=name):
+                    self.assertLessEqual(large[user][name], budget)
+                    self.assertEqual(small[user][name], large[user][name])
+
+    def test_budgets_cover_every_url(self):
+        from .urls import urlpatterns
+        self.seed(1)
+        self.assertEqual({pattern.name for pattern in urlpatterns}, {name for name, url in self.pages()})
+
+
+class SeedAuctionsTests(TestCase):
+    def seed(self, prefix):
+        call_command("seed_auctions", "--users=20", "--listings=30", "--bids=300", "--comments=40",
+                     "--notifications=40", "--seed=7", f"--prefix={prefix}", "--batch-size=50",
+                     stdout=StringIO())
+        listings = Listing.objects.filter(owner__username__startswith=f"{prefix}-").order_by("pk")
+        return [
+            (listing.title, listing.starting_price, listing.current_price, listing.bid_count,
+             list(listing.bids.order_by("pk").values_list("value", flat=True)))
+            for listing in listings
+        ]
+
+    def test_seed_is_consistent_and_deterministic(self):
+        first = self.seed("a")
+        self.assertEqual(len(first), 30)
+        self.assertEqual(Bid.objects.count(), 300)
+        for title, starting_price, current_price, bid_count, values in first:
+            self.assertEqual(values, sorted(set(values)))
+            self.assertEqual(bid_count, len(values))
+            self.assertEqual(current_price, values[-1] if values else starting_price)
+        call_command("repair_bid_summaries", "--verify", stdout=StringIO())
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+        self.assertEqual(self.seed("b"), first)
+        with self.assertRaises(CommandError):
+            self.seed("a")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PhotoVariantTests(AuctionTestCase):
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, name="photo.png", size=(1600, 1200)):
+        output = BytesIO()
+        Image.new("RGB", size, "tomato").save(output, "PNG")
+        return SimpleUploadedFile(name, output.getvalue(), content_type="image/png")
+
+    def test_upload_generates_variants(self):
+        self.client.force_login(self.owner)
+        self.client.post(reverse("new_listing"), {
+            "title": "Camera", "description": "Old camera", "starting_price": 5,
+            "category": self.category.id, "photo": self.upload(),
+        })
+        listing = Listing.objects.get(title="Camera")
+        self.assertFalse(listing.has_photo_variants)
+        call_command("run_jobs", "--once", stdout=StringIO())
+        listing.refresh_from_db()
+        self.assertTrue(listing.has_photo_variants)
+        for variant, box in images.VARIANTS.items():
+            with default_storage.open(images.variant_name(listing.photo.name, variant)) as file:
+                image = Image.open(file)
+                self.assertEqual(image.format, "WEBP")
+                self.assertLessEqual(image.size[0], box[0])
+                self.assertLessEqual(image.size[1], box[1])
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, listing.photo_card_url)
+        self.assertContains(response, f"{listing.photo_card_2x_url} 2x")
+        response = self.client.get(reverse("listing", args=[listing.id]))
+        self.assertContains(response, f"{listing.photo_card_2x_url} 1x, {listing.photo_detail_url} 2x")
+
+    def test_listing_is_not_saved_without_its_photo_job(self):
+        self.client.force_login(self.owner)
+        with mock.patch("auctions.views.enqueue", side_effect=OperationalError), \
+                self.assertRaises(OperationalError):
+            self.client.post(reverse("new_listing"), {
+                "title": "Camera", "description": "Old camera", "starting_price": 5,
+                "category": self.category.id, "photo": self.upload(),
+            })
+        self.assertFalse(Listing.objects.filter(title="Camera").exists())
+
+    def test_backfill_command(self):
+        name = default_storage.save("listings/old.png", self.upload())
+        Listing.objects.filter(pk=self.listing.pk).update(photo=name)
+        call_command("generate_photo_variants", "--workers=2", stdout=StringIO())
+        self.listing.refresh_from_db()
+        self.assertTrue(self.listing.has_photo_variants)
+        self.assertTrue(default_storage.exists(images.variant_name(name, "detail")))
+
+
+class JobQueueTests(AuctionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        jobs.TASKS["test"] = self.handler
+
+    def tearDown(self):
+        del jobs.TASKS["test"]
+
+    def handler(self, fail=0):
+        self.calls.append(fail)
+        if len(self.calls) <= fail:
+            raise ValueError("boom")
+
+    def test_jobs_run_once_and_are_removed(self):
+        jobs.enqueue("test")
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(self.calls, [0])
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_failures_back_off_then_give_up(self):
+        job = jobs.enqueue("test", max_attempts=2, fail=5)
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(jobs.run_pending(), 0)
+        Job.objects.update(run_at=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_claimed_jobs_are_hidden_until_the_timeout(self):
+        jobs.enqueue("test")
+        claimed = jobs.claim("crashed", 10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(jobs.claim("other", 10), [])
+        Job.objects.update(run_at=timezone.now())
+        reclaimed = jobs.claim("other", 10)
+        self.assertEqual([job.pk for job in reclaimed], [claimed[0].pk])
+        # The first worker lost its claim, so its late result is ignored.
+        jobs.execute(claimed[0])
+        self.assertTrue(Job.objects.filter(pk=claimed[0].pk).exists())
+        jobs.execute(reclaimed[0])
+        self.assertFalse(Job.objects.exists())
+
+    def test_jobs_out_of_attempts_are_not_claimed_again(self):
+        job = jobs.enqueue("test", max_attempts=1)
+        self.assertEqual(len(jobs.claim("crashed", 10)), 1)
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.claim("other", 10), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertEqual(self.calls, [])
+
+    def test_listing_is_not_closed_without_its_jobs(self):
+        self.client.force_login(self.owner)
+        with mock.patch("auctions.views.enqueue", side_effect=OperationalError), \
+                self.assertRaises(OperationalError):
+            self.client.get(reverse("deactivate", args=[self.listing.id]))
+        self.assertTrue(Listing.objects.get(pk=self.listing.pk).active)
+
+    def test_closing_listing_notifies_winner_in_background(self):
+        Bid.objects.create(value=20, user=self.alice, listing=self.listing)
+        self.client.force_login(self.owner)
+        self.client.get(reverse("deactivate", args=[self.listing.id]))
+        self.assertFalse(self.alice.notifications.exists())
+        call_command("run_jobs", "--once", stdout=StringIO())
+        self.assertEqual(self.alice.notifications.get().url, reverse("listing", args=[self.listing.id]))
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.unread_count, 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedStorageTests(AuctionTestCase):
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def photo(self, color="tomato"):
+        output = BytesIO()
+        Image.new("RGB", (40, 30), color).save(output, "PNG")
+        return output.getvalue()
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.create_listing(photo=SimpleUploadedFile("a.png", self.photo()))
+        second = self.create_listing(photo=SimpleUploadedFile("b.png", self.photo()))
+        other = self.create_listing(photo=SimpleUploadedFile("a.png", self.photo("navy")))
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertNotEqual(first.photo.name, other.photo.name)
+        self.assertRegex(first.photo.name, STORAGE_BLOB_NAME)
+        self.assertEqual(PhotoBlob.objects.get(name=first.photo.name).references, 2)
+
+        first.delete()
+        self.assertTrue(first.photo.storage.exists(second.photo.name))
+        second.delete()
+        self.assertEqual(PhotoBlob.objects.get(name=second.photo.name).references, 0)
+        call_command("collect_photo_blobs", "--grace-hours=0", stdout=StringIO())
+        self.assertFalse(second.photo.storage.exists(second.photo.name))
+        self.assertTrue(other.photo.storage.exists(other.photo.name))
+
+    def test_replacing_photo_releases_old_blob(self):
+        listing = self.create_listing(photo=SimpleUploadedFile("a.png", self.photo()))
+        old = listing.photo.name
+        listing = Listing.objects.get(pk=listing.pk)
+        listing.photo = SimpleUploadedFile("b.png", self.photo("navy"))
+        listing.save()
+        self.assertEqual(PhotoBlob.objects.get(name=old).references, 0)
+        self.assertEqual(PhotoBlob.objects.get(name=listing.photo.name).references, 1)
+
+    def test_uploading_same_photo_again_keeps_one_reference(self):
+        listing = self.create_listing(photo=SimpleUploadedFile("a.png", self.photo()))
+        listing = Listing.objects.get(pk=listing.pk)
+        listing.photo = SimpleUploadedFile("b.png", self.photo())
+        listing.save()
+        self.assertEqual(PhotoBlob.objects.get(name=listing.photo.name).references, 1)
+
+    def test_failed_save_takes_no_reference(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            listing = self.create_listing(photo=SimpleUploadedFile("a.png", self.photo()))
+            raise ValueError
+        self.assertFalse(PhotoBlob.objects.exists())
+        self.assertTrue(listing.photo.storage.exists(listing.photo.name))
+        call_command("collect_photo_blobs", stdout=StringIO())
+        self.assertTrue(listing.photo.storage.exists(listing.photo.name))
+        call_command("collect_photo_blobs", "--grace-hours=0", stdout=StringIO())
+        self.assertFalse(listing.photo.storage.exists(listing.photo.name))
+
+    def test_seeded_listings_reference_reused_photos(self):
+        listing = self.create_listing(photo=SimpleUploadedFile("a.png", self.photo()))
+        call_command("seed_auctions", "--users=3", "--listings=5", "--bids=0", "--comments=0",
+                     "--notifications=0", "--watchlist=0", stdout=StringIO())
+        uses = Listing.objects.filter(photo=listing.photo.name).count()
+        self.assertGreater(uses, 1)
+        self.assertEqual(PhotoBlob.objects.get(name=listing.photo.name).references, uses)
+
+    def test_dedup_command(self):
+        for name in ("sofa.png", "sofa_x1Y2z3.png", "lamp.png"):
+            default_storage.save(f"listings/{name}", BytesIO(self.photo("navy" if name == "lamp.png" else "tomato")))
+        sofa = self.create_listing(photo="listings/sofa.png")
+        copy = self.create_listing(photo="listings/sofa_x1Y2z3.png")
+        call_command("dedup_photos", stdout=StringIO())
+        sofa.refresh_from_db()
+        copy.refresh_from_db()
+        self.assertEqual(sofa.photo.name, copy.photo.name)
+        self.assertRegex(sofa.photo.name, STORAGE_BLOB_NAME)
+        self.assertFalse(default_storage.exists("listings/sofa.png"))
+        self.assertFalse(default_storage.exists("listings/sofa_x1Y2z3.png"))
+        self.assertEqual(PhotoBlob.objects.get(name=sofa.photo.name).references, 2)
+        lamp = PhotoBlob.objects.exclude(name=sofa.photo.name).get(name__endswith=".png")
+        self.assertEqual(lamp.references, 0)
+
+    def test_blobs_are_served_as_immutable(self):
+        listing = self.create_listing(photo=SimpleUploadedFile("a.png", self.photo()))
+        request = RequestFactory().get("/")
+        response = serve_immutable(request, listing.photo.name, document_root=settings.MEDIA_ROOT)
+        self.assertIn("immutable", response["Cache-Control"])
+        default_storage.save("listings/plain.png", BytesIO(self.photo()))
+        response = serve_immutable(request, "listings/plain.png", document_root=settings.MEDIA_ROOT)
+        self.assertFalse(response.has_header("Cache-Control"))
+
+
+@mock.patch("auctions.events.close_old_connections", lambda: None)
+class ListingEventTests(AuctionTestCase):
+    def stream(self, listing_id, action=None, until=b"event: closed"):
+        """Open the event stream of a listing, run `action` once subscribed and collect the events."""
+        sent = []
+
+        async def run():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                body = message.get("body", b"")
+                if len(sent) == 2 and action:
+                    await sync_to_async(action)()
+                if until in body or (message["type"] == "http.response.body" and not message.get("more_body")):
+                    disconnected.set()
+
+            scope = {"type": "http", "method": "GET", "path": f"/listing/{listing_id}/events"}
+            app = events.events_application(None)
+            await app(scope, receive, send)
+
+        async_to_sync(run)()
+        return sent
+
+    def parse(self, sent):
+        parsed = []
+        for message in sent[1:]:
+            for block in message.get("body", b"").decode().split("\n\n"):
+                if block.startswith("event: "):
+                    event, data = block.split("\n")
+                    parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return parsed
+
+    def test_bids_comments_and_closing_are_streamed(self):
+        def act():
+            with self.captureOnCommitCallbacks(execute=True):
+                bidding.place_bid(self.listing, self.alice, 20)
+            with self.captureOnCommitCallbacks(execute=True):
+                Comment.objects.create(user=self.bob, listing=self.listing, text="<b>Nice</b>")
+            with self.captureOnCommitCallbacks(execute=True):
+                Bid.objects.create(value=25, user=self.bob, listing=self.listing).delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.listing.active = False
+                self.listing.save()
+
+        sent = self.stream(self.listing.id, act)
+        self.assertIn((b"content-type", b"text/event-stream"), sent[0]["headers"])
+        parsed = self.parse(sent)
+        self.assertEqual([event for event, data in parsed], ["price", "bid", "comment", "bid", "changed", "closed"])
+        self.assertEqual(parsed[0][1], {"current_price": 10, "bid_count": 0, "active": True})
+        # Who bids and who leads is only shown to the owner.
+        self.assertEqual(parsed[1][1], {"id": Bid.objects.get().id, "value": 20})
+        self.assertEqual(parsed[4][1], {})
+        self.assertEqual(parsed[2][1]["text"], "<b>Nice</b>")
+        self.assertEqual(parsed[5][1], {"current_price": 20, "bid_count": 1, "active": False})
+        self.assertEqual(events.broker.channels, {})
+
+    def test_nothing_is_published_without_watchers(self):
+        with mock.patch.object(events.LocalBackend, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                bidding.place_bid(self.listing, self.alice, 20)
+        publish.assert_not_called()
+
+    def test_rejected_bids_are_not_streamed(self):
+        def act():
+            with self.captureOnCommitCallbacks(execute=True):
+                bidding.place_bid(self.listing, self.alice, 20)
+            stale = Listing.objects.get(pk=self.listing.pk)
+            Listing.objects.filter(pk=self.listing.pk).update(current_price=30, bid_count=2)
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.assertEqual(bidding.place_bid(stale, self.bob, 25).status, bidding.STALE)
+            self.assertEqual(callbacks, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                Listing.objects.filter(pk=self.listing.pk).update(active=False)
+                events.publish(self.listing.id, "closed", {})
+
+        events_seen = [event for event, data in self.parse(self.stream(self.listing.id, act))]
+        self.assertEqual(events_seen, ["price", "bid", "closed"])
+
+    def test_unknown_listing(self):
+        sent = self.stream(self.listing.id + 100)
+        self.assertEqual(sent[0]["status"], 404)
+
+    def test_slow_watchers_are_cut_off(self):
+        async def run():
+            subscription = events.broker.subscribe("test")
+            for i in range(events.QUEUE_SIZE + 5):
+                subscription.put({"event": "price", "data": i})
+            events.broker.unsubscribe(subscription)
+            return await subscription.get()
+
+        self.assertIsNone(async_to_sync(run)())
+
+
+class ScheduledCloseTests(AuctionTestCase):
+    def expired_listing(self, bidder=None, **kwargs):
+        listing = self.create_listing(**kwargs)
+        if bidder:
+            Bid.objects.create(value=20, user=bidder, listing=listing)
+        Listing.objects.filter(pk=listing.pk).update(ends_at=timezone.now() - timezone.timedelta(minutes=1))
+        return listing
+
+    def test_expired_listings_are_closed_and_winners_notified(self):
+        won = [self.expired_listing(self.alice), self.expired_listing(self.alice), self.expired_listing(self.bob)]
+        unsold = self.expired_listing()
+        later = self.create_listing(ends_at=timezone.now() + timezone.timedelta(days=1))
+        call_command("close_expired_auctions", "--batch-size=2", stdout=StringIO())
+
+        self.assertEqual(set(Listing.objects.filter(active=False)), set(won + [unsold]))
+        self.assertTrue(Listing.objects.get(pk=later.pk).active)
+        self.assertTrue(Listing.objects.get(pk=self.listing.pk).active)
+        self.assertEqual(self.alice.notifications.count(), 2)
+        self.assertEqual(self.bob.notifications.get().url, reverse("listing", args=[won[2].id]))
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
+        self.assertGreater(Listing.objects.get(pk=unsold.pk).version, unsold.version)
+
+        out = StringIO()
+        call_command("close_expired_auctions", stdout=out)
+        self.assertIn("Closed 0 listing(s)", out.getvalue())
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_expired_listings_take_no_bids(self):
+        listing = self.expired_listing()
+        stale = Listing.objects.get(pk=listing.pk)
+        self.assertEqual(bidding.place_bid(stale, self.alice, 50).status, bidding.CLOSED)
+        # An instance loaded before the end was set still loses the compare-and-set.
+        self.listing.refresh_from_db()
+        Listing.objects.filter(pk=self.listing.pk).update(ends_at=timezone.now())
+        self.assertEqual(bidding.place_bid(self.listing, self.alice, 50).status, bidding.CLOSED)
+        self.assertFalse(Bid.objects.exists())
+
+    def test_end_must_be_in_the_future(self):
+        self.client.force_login(self.owner)
+        response = self.client.post(reverse("new_listing"), {
+            "title": "Camera", "description": "Old camera", "starting_price": 5,
+            "category": self.category.id, "ends_at": "2021-01-01T10:00",
+        })
+        self.assertFormError(response, "form", "ends_at", "The end time must be in the future.")
+
+
+class BidStressTests(AuctionFixtures, TransactionTestCase):
+    THREADS = 8
+    LEVELS = 40
+
+    def bidder(self, user, results):
+        rng = random.Random(user.pk)
+        try:
+            for value in range(11, 11 + self.LEVELS):
+                while True:
+                    try:
+                        listing = Listing.objects.get(pk=self.listing.pk)
+                        outcome = bidding.place_bid(listing, user, value)
+                        break
+                    except OperationalError:
+                        # Shared-cache in-memory SQLite reports lock contention
+                        # instead of waiting; back off and retry like a client.
+                        time.sleep(rng.random() / 1000)
+                results.append(outcome.status)
+        finally:
+            connection.close()
+
+    def test_concurrent_bids_have_one_winner_per_price(self):
+        users = [
+            User.objects.create_user(f"bidder{i}", f"bidder{i}@example.com", "password")
+            for i in range(self.THREADS)
+        ]
+        results = []
+        threads = [threading.Thread(target=self.bidder, args=(user, results)) for user in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        values = list(self.listing.bids.values_list("value", flat=True))
+        self.assertEqual(sorted(values), list(range(11, 11 + self.LEVELS)))
+        self.assertEqual(results.count(bidding.ACCEPTED), self.LEVELS)
+        self.assertEqual(len(results), self.THREADS * self.LEVELS)
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.current_price, 10 + self.LEVELS)
+        self.assertEqual(self.listing.bid_count, self.LEVELS)
+        print(f"\n{len(results)} bid attempts in {elapsed:.2f}s "
+              f"({len(results) / elapsed:.0f} bids/s, {self.LEVELS} accepted)")
+
+
+class ScheduledCloseStressTests(AuctionFixtures, TransactionTestCase):
+    CLOSERS = 4
+    LISTINGS = 300
+
+    def closer(self, results):
+        rng = random.Random(threading.get_ident())
+        try:
+            while True:
+                try:
+                    closed = closing.close_expired_batch(batch_size=50)
+                except OperationalError:
+                    time.sleep(rng.random() / 1000)
+                    continue
+                results.append(closed)
+                if not closed:
+                    break
+        finally:
+            connection.close()
+
+    def test_concurrent_closers_close_each_listing_once(self):
+        bidders = [self.alice, self.bob]
+        for i in range(self.LISTINGS):
+            listing = self.create_listing(title=f"Listing {i}")
+            Bid.objects.create(value=20, user=bidders[i % 2], listing=listing)
+        Listing.objects.exclude(pk=self.listing.pk).update(ends_at=timezone.now())
+
+        results = []
+        threads = [threading.Thread(target=self.closer, args=(results,)) for _ in range(self.CLOSERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(results), self.LISTINGS)
+        self.assertEqual(Listing.objects.filter(active=True).get(), self.listing)
+        self.assertEqual(Notification.objects.count(), self.LISTINGS)
+        self.assertEqual(Notification.objects.values("url").distinct().count(), self.LISTINGS)
+        call_command("repair_unread_counts", "--verify", stdout=StringIO())
+        call_command("repair_category_counts", "--verify", stdout=StringIO())
@@ -0,0 +1,147 @@
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+
+# A sampled fraction (SERVER_TIMING_SAMPLE_RATE) of requests is timed: SQL
+# through database execute wrappers, templates through TimedDjangoTemplates.
+# Each gets a Server-Timing header, and its timings join a rolling window of
+# the last SERVER_TIMING_WINDOW requests of its route, kept per process.
+# Unsampled requests only pay for one random number.
+MAX_ROUTES = 200
+
+_current = contextvars.ContextVar("request_timing", default=None)
+_lock = threading.Lock()
+_routes = {}
+
+
+class RequestTiming:
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.templates = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - started
+            self.queries += 1
+
+
+def sampled():
+    rate = settings.SERVER_TIMING_SAMPLE_RATE
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def record(route, total, timing):
+    with _lock:
+        window = _routes.get(route)
+        if window is None:
+            # URL names are a fixed set, but don't trust that forever.
+            if len(_routes) >= MAX_ROUTES:
+                return
+            window = _routes[route] = deque(maxlen=settings.SERVER_TIMING_WINDOW)
+        window.append((total, timing.queries, timing.sql, timing.templates))
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def stats():
+    """Per route timings in milliseconds, over each route's window."""
+    with _lock:
+        windows = {route: list(window) for route, window in _routes.items()}
+    result = {}
+    for route, samples in sorted(windows.items()):
+        totals = sorted(sample[0] for sample in samples)
+        count = len(samples)
+        result[route] = {
+            "count": count,
+            "p50": round(percentile(totals, 0.5) * 1000, 2),
+            "p95": round(percentile(totals, 0.95) * 1000, 2),
+            "p99": round(percentile(totals, 0.99) * 1000, 2),
+            "mean_queries": round(sum(sample[1] for sample in samples) / count, 2),
+            "mean_db": round(sum(sample[2] for sample in samples) / count * 1000, 2),
+            "mean_templates": round(sum(sample[3] for sample in samples) / count * 1000, 2),
+        }
+    return result
+
+
+def reset():
+    with _lock:
+        _routes.clear()
+
+
+def server_timing(total, timing):
+    return ", ".join([
+        f'db;dur={timing.sql * 1000:.1f};desc="{timing.queries} queries"',
+        f"tpl;dur={timing.templates * 1000:.1f}",
+        f"app;dur={(total - timing.sql - timing.templates) * 1000:.1f}",
+        f"total;dur={total * 1000:.1f}",
+    ])
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not sampled():
+            return self.get_response(request)
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timing))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        response["Server-Timing"] = server_timing(total, timing)
+        match = request.resolver_match
+        if match is not None:
+            record(match.view_name, total, timing)
+        return response
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timing = _current.get()
+        if timing is None:
+            return self.template.render(context, request)
+        started, sql = time.perf_counter(), timing.sql
+        try:
+            return self.template.render(context, request)
+        finally:
+            # Querysets evaluated by the template count as database time.
+            timing.templates += time.perf_counter() - started - (timing.sql - sql)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each render for ServerTimingMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
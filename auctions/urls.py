@@ -1,7 +1,7 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.index, name="index"),
@@ -10,14 +10,26 @@ urlpatterns = [
     path("register", views.register, name="register"),
     path("new_listing", views.new_listing, name="new_listing"),
     path("listing/<int:id>", views.listing, name="listing"),
+    path("listing/<int:id>/comments", views.listing_comments, name="listing_comments"),
+    path("listing/<int:id>/bids", views.listing_bids, name="listing_bids"),
     path("watch/<int:id>/", views.watch, name="watch"),
     path("unwatch/<int:id>/", views.unwatch, name="unwatch"),
     path("watchlist", views.watchlist, name="watchlist"),
+    path("api/watchlist", views.watchlist_api, name="watchlist_api"),
     path("deactivate/<int:id>", views.deactivate, name="deactivate"),
     path("categories", views.categories, name="categories"),
     path("category/<str:name>", views.category, name="category"),
+    path("search", views.search, name="search"),
+    path("api/search", views.search_api, name="search_api"),
     path("notifications", views.notifications, name="notifications"),
     path("notification/<int:id>", views.notification, name="notification"),
+    path("notifications/read", views.mark_all_read, name="mark_all_read"),
     path("my-bids", views.my_bids, name="my_bids"),
     path("my-listings", views.my_listings, name="my_listings"),
+    path("stats/timing", views.timing_stats, name="timing_stats"),
+    path("api/v1/listings", api.listings, name="api_listings"),
+    path("api/v1/listings/<int:id>", api.listing, name="api_listing"),
+    path("api/v1/listings/<int:id>/bids", api.listing_bids, name="api_listing_bids"),
+    path("api/v1/listings/<int:id>/comments", api.listing_comments, name="api_listing_comments"),
+    path("api/v1/categories", api.categories, name="api_categories"),
 ]
@@ -1,27 +1,41 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models.fields import CharField, IntegerField, URLField
 from django.forms.forms import Form
-from django.forms.widgets import ClearableFileInput, NumberInput, Select, TextInput, Textarea, URLInput
-from django.http import HttpResponse, HttpResponseRedirect, request
+from django.forms.widgets import ClearableFileInput, DateTimeInput, NumberInput, Select, TextInput, Textarea, URLInput
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, request
 from django.shortcuts import render
 from django.urls import reverse
 from django import forms
 from django.forms import ModelForm, fields, models
 from django.core.validators import MaxLengthValidator
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.views.decorators.http import condition, require_POST
+from django.utils import timezone
+from django.utils.http import url_has_allowed_host_and_scheme
 
+import json
 from datetime import datetime
 
-from .models import Category, Listing, Notification, User, Comment, Bid
+from . import catalog, stamps, timing
+from .replicas import replica_reads
+from .models import Category, Listing, Notification, User, Comment, Bid, unread_count_expression
+from .bidding import place_bid
+from .jobs import enqueue
+from .pagination import paginate
+from .search import search_listings
 
 
+@replica_reads
+@condition(etag_func=stamps.index_etag, last_modified_func=stamps.index_last_modified)
 def index(request):
-    listings = Listing.objects.filter(active=True).order_by("-datetime").all()
-    categories = Category.objects.all()
+    listings = paginate(request, Listing.objects.filter(active=True).cards())
     return render(request, "auctions/index.html", {
         "listings": listings,
-        "categories": categories,
+        "page": listings,
+        "categories": catalog.categories(),
     })
 
 
@@ -115,7 +129,8 @@ def register(request):
 class NewListingForm(ModelForm):
     class Meta:
         model = Listing
-        fields = ["title", "description", "starting_price", "photo", "category"]
+        fields = ["title", "description", "starting_price", "photo", "category", "ends_at"]
+        labels = {"ends_at": "Ends at (optional)"}
         widgets = {
             'title': TextInput(attrs={'autocomplete': 'off', 
                                       "class": "form-input"}),
@@ -125,9 +140,17 @@ class NewListingForm(ModelForm):
             'starting_price': NumberInput(attrs={'autocomplete': 'off', 
                                                  "class": "form-input"}),
             'photo': ClearableFileInput(attrs={"class": "form-input"}),
-            'category': Select(attrs={"class": "form-input"})
+            'category': Select(attrs={"class": "form-input"}),
+            'ends_at': DateTimeInput(attrs={"class": "form-input", "type": "datetime-local"},
+                                     format="%Y-%m-%dT%H:%M"),
         } 
 
+    def clean_ends_at(self):
+        ends_at = self.cleaned_data["ends_at"]
+        if ends_at and ends_at <= timezone.now():
+            raise forms.ValidationError("The end time must be in the future.")
+        return ends_at
+
 @login_required
 def new_listing(request):
     if request.method == "POST":
@@ -137,7 +160,9 @@ def new_listing(request):
             # handle_uploaded_file(request.FILES['photo'], listing.title)
             listing.owner = request.user
             listing.datetime = datetime.now()
-            listing.save()
+            with transaction.atomic():
+                listing.save()
+                enqueue("process_listing_photo", listing_id=listing.id)
             return HttpResponseRedirect(reverse("index"))
         else:
             return render(request, "auctions/new_listing.html",{
@@ -152,10 +177,8 @@ def new_listing(request):
 class BidForm(ModelForm):
     class Meta:
         model = Bid
-        fields = ["value", "user", "listing"]
+        fields = ["value"]
         widgets = {
-            'user': forms.HiddenInput(),
-            'listing': forms.HiddenInput(),
             'value': NumberInput(attrs={'autocomplete': 'off', 'class': 'form-input'})
             }
 
@@ -170,85 +193,137 @@ class CommentForm(ModelForm):
             'text': Textarea(attrs={'autocomplete': 'off', 'class': 'form-input comment-area'})
             }
 
+# Comments and bids shown on the listing page; older ones are fetched from
+# the fragment views below as the visitor asks for them.
+LISTING_SLICE = 20
+
+def listing_comments_page(request, listing, path=None):
+    return paginate(request, listing.comments.select_related("user"), per_page=LISTING_SLICE, path=path)
+
+def listing_bids_page(request, listing, path=None):
+    return paginate(request, listing.bids.select_related("user"), field="value",
+                    per_page=LISTING_SLICE, path=path)
+
+def shows_bid_history(request, listing):
+    return request.user.is_authenticated and request.user.id == listing.owner_id
+
+def render_listing(request, listing, form=None, comment_form=None):
+    return render(request, "auctions/listing.html", {
+        "listing": listing,
+        "form": form or BidForm(),
+        "comment_form": comment_form or CommentForm(),
+        "bids": listing_bids_page(request, listing, reverse("listing_bids", args=[listing.id]))
+                if listing.is_open and shows_bid_history(request, listing) else None,
+        "comments": listing_comments_page(request, listing, reverse("listing_comments", args=[listing.id])),
+        "watching": request.user.is_authenticated and request.user.is_watching(listing),
+    })
+
+def post_comment(request, listing):
+    comment_data = {
+        "text": request.POST.get("text"),
+        "user": request.user,
+        "listing": listing,
+        "datetime": datetime.now(),
+    }
+    comment_form = CommentForm(comment_data)
+    if comment_form.is_valid():
+        comment_form.save()
+    return comment_form
+
+@replica_reads
+@condition(etag_func=stamps.listing_etag)
 def listing(request, id):
     try:
         listing = Listing.objects.get(pk=id)
     except Listing.DoesNotExist:
         return render(request, "auctions/404.html")
-    comments = Comment.objects.filter(listing=listing).order_by("-datetime").all()
     if request.method == "POST":
         if 'place_bid' in request.POST:
-            data = {
-                "value": request.POST.get("value"),
-                "user": request.user,
-                "listing": listing,
-            }
-            form = BidForm(data)
+            if not request.user.is_authenticated:
+                return redirect_to_login(request.get_full_path())
+            form = BidForm(request.POST, instance=Bid(user=request.user, listing=listing))
             if form.is_valid():
-                form.save()
-                return HttpResponseRedirect(reverse('listing', args=[id]))
-            else:
-                return render(request, "auctions/listing.html", {
-                    "listing": listing,
-                    "form": form,
-                    "comment_form": CommentForm(),
-                    "bids": listing.bids.order_by('-value').all(),
-                    "comments": comments,
-                })
+                outcome = place_bid(listing, request.user, form.cleaned_data["value"])
+                if outcome.accepted:
+                    return HttpResponseRedirect(reverse('listing', args=[id]))
+                form.add_error("value", outcome.message)
+            return render_listing(request, listing, form=form)
         if 'comment' in request.POST:
-            comment_data = {
-                "text": request.POST.get("text"),
-                "user": request.user,
-                "listing": listing,
-                "datetime": datetime.now(),
-            }
-            comment_form = CommentForm(comment_data)
+            comment_form = post_comment(request, listing)
             if comment_form.is_valid():
-                comment_form.save()
                 return HttpResponseRedirect(reverse('listing', args=[id]))
-            else:
-                return render(request, "auctions/listing.html", {
-                    "listing": listing,
-                    "form": BidForm(),
-                    "comment_form": comment_form,
-                    "bids": listing.bids.order_by('-value').all(),
-                    "comments": comments,
-                })
-    return render(request, "auctions/listing.html", {
-        "listing": listing,
-        "form": BidForm(),
-        "comment_form": CommentForm(),
-        "bids": listing.bids.order_by('-value').all(),
-        "comments": comments,
-    })
+            return render_listing(request, listing, comment_form=comment_form)
+    return render_listing(request, listing)
 
-@login_required
-def watch(request, id):
-    try:
-        listing = Listing.objects.get(pk=id)
-    except Listing.DoesNotExist:
-        return render(request, "auctions/404.html")
+@replica_reads
+@condition(etag_func=stamps.listing_etag)
+def listing_comments(request, id):
+    """Older comments as an HTML fragment; a POST adds one and returns just it."""
+    listing = Listing.objects.filter(pk=id).first()
+    if listing is None:
+        return HttpResponse(status=404)
+    if request.method == "POST":
+        if not request.user.is_authenticated:
+            return HttpResponse(status=403)
+        comment_form = post_comment(request, listing)
+        if not comment_form.is_valid():
+            return HttpResponse(comment_form.errors.as_ul(), status=400)
+        return render(request, "auctions/comments.html", {"comments": [comment_form.instance]}, status=201)
+    return render(request, "auctions/comments.html", {"comments": listing_comments_page(request, listing)})
+
+@replica_reads
+@condition(etag_func=stamps.listing_etag)
+def listing_bids(request, id):
+    """Older bids as an HTML fragment, for the owner's bid history."""
+    listing = Listing.objects.filter(pk=id).first()
+    if listing is None:
+        return HttpResponse(status=404)
+    if not shows_bid_history(request, listing):
+        return HttpResponse(status=403)
+    return render(request, "auctions/bids.html", {"bids": listing_bids_page(request, listing)})
+
+WATCHLIST_API_LIMIT = 500
+
+def watch_redirect(request, id):
     next = request.GET.get("next")
-    user = request.user
-    user.watchlist.add(listing)
-    user.save()
-    if next:
+    if next and url_has_allowed_host_and_scheme(next, allowed_hosts={request.get_host()}):
         return HttpResponseRedirect(next)
     return HttpResponseRedirect(reverse('listing', args=[id]))
 
+@login_required
+def watch(request, id):
+    if not Listing.objects.filter(pk=id).exists():
+        return render(request, "auctions/404.html")
+    request.user.watch([id])
+    return watch_redirect(request, id)
+
 @login_required
 def unwatch(request, id):
+    request.user.unwatch([id])
+    return watch_redirect(request, id)
+
+@login_required
+@require_POST
+def watchlist_api(request):
+    # Takes {"watch": [ids], "unwatch": [ids]}; unknown listings are not watched.
     try:
-        listing = Listing.objects.get(pk=id)
-    except Listing.DoesNotExist:
-        return render(request, "auctions/404.html")
-    next = request.GET.get("next")
+        body = json.loads(request.body)
+        watch = {int(pk) for pk in body.get("watch", [])}
+        unwatch = {int(pk) for pk in body.get("unwatch", [])}
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"error": "Expected {\"watch\": [ids], \"unwatch\": [ids]}."}, status=400)
+    if len(watch) + len(unwatch) > WATCHLIST_API_LIMIT:
+        return JsonResponse({"error": f"At most {WATCHLIST_API_LIMIT} listings per request."}, status=400)
+    if watch & unwatch:
+        return JsonResponse({"error": "A listing cannot be both watched and unwatched."}, status=400)
     user = request.user
-    user.watchlist.remove(listing)
-    user.save()
-    if next:
-        return HttpResponseRedirect(next)
-    return HttpResponseRedirect(reverse('listing', args=[id]))
+    with transaction.atomic():
+        watch = set(Listing.objects.filter(pk__in=watch).values_list("pk", flat=True))
+        if watch:
+            user.watch(watch)
+        if unwatch:
+            user.unwatch(unwatch)
+    return JsonResponse({"watched": sorted(watch), "unwatched": sorted(unwatch)})
 
 @login_required
 def deactivate(request, id):
@@ -261,48 +336,108 @@ def deactivate(request, id):
     user = request.user
     if user == listing.owner:
         listing.active = False
-        listing.save()
-        notification_text = f'Congratulations! You won the bid {listing}!'
-        notification = Notification(user=listing.highest_bid().user, 
-                    text=notification_text, 
-                    datetime=datetime.now(),
-                    url=reverse('listing', args=[listing.id]),
-                    )
-        notification.save()
+        with transaction.atomic():
+            listing.save()
+            enqueue("notify_winner", listing_id=listing.id)
+            enqueue("notify_watchers", listing_id=listing.id)
         return HttpResponseRedirect(reverse('listing', args=[id]))
     else:
         return render(request, "auctions/forbidden.html")
 
+@replica_reads
 def categories(request):
-    categories = Category.objects.all()
     return render(request, "auctions/categories.html", {
-        "categories": categories,
+        "categories": catalog.categories(),
     })
 
+@replica_reads
+@condition(etag_func=stamps.category_etag, last_modified_func=stamps.category_last_modified)
 def category(request, name):
-    category = Category.objects.filter(name=name).first()
+    category = catalog.get(name)
     if not category:
         return render(request, "auctions/404.html")
     else:
+        listings = paginate(request, category.listings.filter(active=True).cards())
         return render(request, "auctions/index.html", {
-            "listings": category.listings.filter(active=True).order_by("-datetime").all(),
+            "listings": listings,
+            "page": listings,
             "category": category,
-            "categories" : Category.objects.all()
+            "categories": catalog.categories(),
         })
+SEARCH_STATUSES = {
+    "active": {"active": True},
+    "closed": {"active": False},
+    "all": {},
+}
+
+
+def search_results(request):
+    query = request.GET.get("q", "").strip()
+    status = request.GET.get("status")
+    listings = Listing.objects.filter(**SEARCH_STATUSES.get(status, SEARCH_STATUSES["active"]))
+    if request.GET.get("category"):
+        listings = listings.filter(category__name=request.GET["category"])
+    listings = search_listings(query, listings.cards())
+    return query, paginate(request, listings, field="rank")
+
+
+def search(request):
+    query, listings = search_results(request)
+    return render(request, "auctions/search.html", {
+        "listings": listings,
+        "page": listings,
+        "query": query,
+        "statuses": SEARCH_STATUSES,
+        "categories": catalog.categories(),
+    })
+
+
+def search_api(request):
+    query, listings = search_results(request)
+    return JsonResponse({
+        "query": query,
+        "results": [{
+            "id": listing.id,
+            "title": listing.title,
+            "url": reverse("listing", args=[listing.id]),
+            "current_price": listing.current_price,
+            "active": listing.active,
+            "category": listing.category.name if listing.category else None,
+            "owner": listing.owner.username,
+            "rank": listing.rank,
+        } for listing in listings],
+        "next": listings.next_url,
+        "previous": listings.previous_url,
+    })
+
 @login_required
+@replica_reads
 def watchlist(request):
+    # Not request.user.watchlist, which would read from the primary like the user.
+    listings = paginate(request, Listing.objects.filter(users_watching=request.user).cards())
     return render(request, "auctions/watchlist.html",{
-        "listings": request.user.watchlist.order_by("-datetime").all()
+        "listings": listings,
+        "page": listings,
     })
 
 @login_required
 def notifications(request):
     user = request.user
-    notifications = user.notifications.order_by("-datetime").all()
+    notifications = paginate(request, user.notifications.all())
     return render(request, "auctions/notifications.html",{
         "notifications": notifications,
+        "page": notifications,
     })
 
+@login_required
+@require_POST
+def mark_all_read(request):
+    with transaction.atomic():
+        request.user.notifications.mark_seen()
+        # Recounted even with nothing left to mark, so a drifted counter is repaired.
+        User.objects.filter(pk=request.user.pk).update(unread_count=unread_count_expression())
+    return HttpResponseRedirect(reverse("notifications"))
+
 @login_required
 def notification(request, id):
     try:
@@ -311,20 +446,34 @@ def notification(request, id):
         return render(request, "auctions/404.html")
     if notification.user != request.user:
         return render(request, "auctions/forbidden.html")
-    notification.seen = True
-    notification.save()
+    notification.mark_seen()
     return HttpResponseRedirect(notification.url)
 
 @login_required
 def my_listings(request):
     user = request.user
+    listings = paginate(request, user.listings.cards(comment_count=True))
     return render(request, "auctions/my_listings.html", {
-        "listings": user.listings.order_by("active").order_by("-datetime").all()
+        "listings": listings,
+        "page": listings,
     })
 
 @login_required
+@replica_reads
 def my_bids(request):
-    user = request.user
+    listings = paginate(request, Listing.objects.bid_on_by(request.user).select_related("owner"),
+                        field="last_bid_at")
     return render(request, "auctions/my_bids.html", {
-        "bids": user.bids.order_by("-datetime").all()
-    })
\ No newline at end of file
+        "listings": listings,
+        "page": listings,
+    })
+
+@login_required
+def timing_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Staff only."}, status=403)
+    return JsonResponse({
+        "sample_rate": settings.SERVER_TIMING_SAMPLE_RATE,
+        "window": settings.SERVER_TIMING_WINDOW,
+        "routes": timing.stats(),
+    })
@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up. Serves /listing/<id>/events as server-sent
+# events and hands every other request to Django.
+from auctions.events import events_application  # noqa: E402
+
+application = events_application(django_application)
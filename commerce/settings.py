@@ -50,12 +50,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auctions.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'auctions.replicas.StickyPrimaryMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -64,7 +66,8 @@ ROOT_URLCONF = 'commerce.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for ServerTimingMiddleware.
+        'BACKEND': 'auctions.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -73,6 +76,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'auctions.context_processors.unread_notifications',
+                'auctions.context_processors.watched_listings',
             ],
         },
     },
@@ -93,6 +98,36 @@ DATABASES = {
 
 AUTH_USER_MODEL = 'auctions.User'
 
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+#
+# Rendered listing cards live in the "fragments" cache, keyed by listing
+# version. The local-memory backend evicts the least recently used entries
+# past MAX_ENTRIES; point FRAGMENT_CACHE_BACKEND/FRAGMENT_CACHE_LOCATION at a
+# shared backend (e.g. PyMemcacheCache) to share cards between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': os.environ.get('FRAGMENT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_LOCATION', 'fragments'),
+        'TIMEOUT': None,
+    },
+}
+if CACHES['fragments']['BACKEND'].endswith('LocMemCache'):
+    CACHES['fragments']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 5000)),
+    }
+
+# Live listing updates (see auctions.events) reach watchers connected to the
+# same process by default. With several processes or hosts on PostgreSQL,
+# set EVENTS_BACKEND=auctions.events.PostgresBackend to relay them through
+# LISTEN/NOTIFY.
+
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'auctions.events.LocalBackend')
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -149,6 +184,34 @@ import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# SQLITE_PROFILE=concurrent switches a SQLite database to a backend tuned for
+# several workers writing at once: WAL, a busy timeout and immediate write
+# transactions (see auctions.backends.sqlite3). Compare with
+# `manage.py benchmark_sqlite`.
+if os.environ.get('SQLITE_PROFILE') == 'concurrent' and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['ENGINE'] = 'auctions.backends.sqlite3'
+
+# Read replicas, as space or comma separated database URLs. Views marked
+# with auctions.replicas.replica_reads read from them; everything else, and
+# anyone who wrote in the last REPLICA_STICKY_SECONDS, uses the primary. To
+# try it locally, point a replica at the same SQLite file or at a second
+# copy of it, e.g. DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3.
+DATABASE_REPLICAS = []
+for number, url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').replace(',', ' ').split()):
+    alias = f'replica{number + 1}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=500)
+    # Tests run against the primary's test database.
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['auctions.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+# Fraction of requests timed by auctions.timing.ServerTimingMiddleware, which
+# adds a Server-Timing header and keeps per route statistics over the last
+# SERVER_TIMING_WINDOW timed requests; staff can read them at /stats/timing.
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', 0))
+SERVER_TIMING_WINDOW = int(os.environ.get('SERVER_TIMING_WINDOW', 1000))
+
 
 
 if os.environ.get('STORAGE', '') == 'CLOUDINARY':
@@ -158,7 +221,10 @@ if os.environ.get('STORAGE', '') == 'CLOUDINARY':
         'API_SECRET': os.environ.get('CLOUDINARY_API_SECRET',''),
     }
     DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+    PHOTO_STORAGE = DEFAULT_FILE_STORAGE
 else:
     MEDIA_ROOT  = os.path.join(BASE_DIR, 'media')
+    # Listing photos are stored once per unique content, see auctions.storage.
+    PHOTO_STORAGE = 'auctions.storage.ContentAddressedStorage'
 # MEDIA_ROOT  = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
\ No newline at end of file
@@ -18,7 +18,9 @@ from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from auctions.storage import serve_immutable
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("auctions.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+] + static(settings.MEDIA_URL, view=serve_immutable, document_root=settings.MEDIA_ROOT)
\ No newline at end of file